@@ -0,0 +1,233 @@
+"""
+Render admission control
+
+estimate_render() predicts the cost of a plot from the cell summary before
+anything is rendered: facet panels, x ticks, fill groups, cells, jitter
+points and the figure size. plan_render() checks the estimate against the
+RENDER LIMITS in config. A boxplot with too many points has its jitter layer
+downsampled, or dropped, and a plot that cannot be made small enough is
+refused. admit() then holds the render to a per-session concurrency limit and
+to a global budget of estimated cost in flight, queueing until budget frees.
+
+Admitted renders are rows of the render_admissions table in the coordination
+database (see db.py), so the limits hold across every web worker process
+without waiting on the session store's write lock. A row left behind by a
+process that died stops counting once the render would have timed out.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import config
+from cell_stats import figure_layout, plot_keys, summary_cells
+from db import get_coordination
+from metrics import stage
+
+# What matplotlib draws, in jitter point equivalents
+CELL_COST = 20      # a box with whiskers, or a bar with its error bar
+TICK_COST = 10      # a tick with its label, per panel
+PANEL_COST = 200    # axes, spines and facet strips
+
+# Seconds between budget checks of a queued render, renders finishing in
+# this process wake it up sooner
+ADMISSION_POLL_SECONDS = 0.25
+
+# Admission counters of this process for /metrics, in_flight() has the gauges
+admission_stats = {
+    "degraded": 0,
+    "rejected_too_large": 0,
+    "rejected_session_limit": 0,
+    "rejected_busy": 0,
+}
+_budget = threading.Condition()
+
+
+class AdmissionError(Exception):
+    """A render was refused before it started, status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def jitter_points(cell_n, cap=None):
+    """Points the jitter layer draws for cells of these sizes with at most cap per cell"""
+    return int(cell_n.sum() if cap is None else cell_n.clip(upper=cap).sum())
+
+def jitter_note(cell_n, cap):
+    """Caption of a boxplot whose cells of these sizes draw at most cap points, None if none is left out"""
+    if cap and jitter_points(cell_n, cap) == jitter_points(cell_n):
+        return None
+    if cap:
+        return f"Showing at most {cap:,} points per box, {int(cell_n.sum()):,} in total"
+    return "Boxes only, there are too many boxes to show their points"
+
+def plot_note(summary, spec):
+    """jitter_note() of one plot of a batch rendered with the batch's shared spec"""
+    if "jitter_cap" not in spec:
+        return None
+    cells = summary_cells(summary, plot_keys(spec), "mean")
+    return jitter_note(cells["n"][cells["n"] > 0], spec["jitter_cap"])
+
+def estimate_render(summary, spec):
+    """
+    Predicted size and cost of rendering spec, from the filtered melt summary.
+
+    cost is in jitter point equivalents, the unit of RENDER_BUDGET.
+    """
+    keys = plot_keys(spec)
+    # Pooled counts work for any plotted cells, the mean is not used
+    cells = summary_cells(summary, keys, "mean")
+    cell_n = cells["n"][cells["n"] > 0]
+
+    n_groups = summary[spec["group"]].nunique()
+    panel_width, nrow, ncol, _ = figure_layout(summary, spec["xaxis"], spec["frows"], spec["fcols"],
+                                               spec["group"], n_groups)
+    panels = nrow * ncol
+    ticks = summary[spec["xaxis"]].nunique()
+
+    points = 0
+    if spec["graph_type"] == 'Boxplot':
+        # Same reduction as build_graph applies to large data
+        cap = spec.get("jitter_cap")
+        if cap is None and cell_n.sum() > config.BOXPLOT_LARGE_N_THRESHOLD and config.BOXPLOT_LARGE_N_MODE != "raster":
+            cap = config.BOXPLOT_JITTER_CAP_PER_CELL
+        points = jitter_points(cell_n, cap)
+
+    return {
+        "panels": panels,
+        "ticks": ticks,
+        "groups": n_groups,
+        "cells": len(cell_n),
+        "points": points,
+        "width_in": panel_width * ncol,
+        "height_in": config.PLOT_PANEL_HEIGHT * nrow + 1,
+        "cost": points + CELL_COST * len(cell_n) + (TICK_COST * ticks + PANEL_COST) * panels,
+    }
+
+def _too_large(message):
+    with _budget:
+        admission_stats["rejected_too_large"] += 1
+    return AdmissionError(message, 400)
+
+def plan_render(summary, spec, format="svg", dpi=config.PLOT_RASTER_DPI):
+    """
+    Fit a render of spec within the RENDER LIMITS.
+
+    Returns the spec to render, possibly with a jitter_cap and a note saying
+    what was simplified, the dpi to render at and the estimate. Raises
+    AdmissionError for plots that cannot be made small enough.
+    """
+    estimate = estimate_render(summary, spec)
+
+    if estimate["panels"] > config.RENDER_MAX_PANELS:
+        raise _too_large(
+            f"This plot would have {estimate['panels']} facet panels, the limit is {config.RENDER_MAX_PANELS}. "
+            f"Facet on a column with fewer values or filter the data.")
+    if max(estimate["width_in"], estimate["height_in"]) > config.RENDER_MAX_FIGURE_INCHES:
+        raise _too_large(
+            f"This plot would be {estimate['width_in']:.0f} x {estimate['height_in']:.0f} inches, the limit is "
+            f"{config.RENDER_MAX_FIGURE_INCHES}. Choose axis and facet columns with fewer values or filter the data.")
+
+    if estimate["points"] > config.RENDER_MAX_POINTS:
+        if not config.RENDER_AUTO_DEGRADE:
+            raise _too_large(
+                f"This plot would draw {estimate['points']:,} points, the limit is {config.RENDER_MAX_POINTS:,}. "
+                f"Plot a bar chart or filter the data.")
+        # Largest per cell cap that fits, found by bisection
+        cells = summary_cells(summary, plot_keys(spec), "mean")
+        cell_n = cells["n"][cells["n"] > 0]
+        low, high = 0, int(cell_n.max())
+        while low < high:
+            mid = (low + high + 1) // 2
+            if jitter_points(cell_n, mid) <= config.RENDER_MAX_POINTS:
+                low = mid
+            else:
+                high = mid - 1
+        spec = {**spec, "jitter_cap": low, "note": jitter_note(cell_n, low)}
+        estimate = estimate_render(summary, spec)
+        with _budget:
+            admission_stats["degraded"] += 1
+
+    # Whole-figure bitmaps, and the rasterized layers of a PDF, grow with dpi squared
+    if format in ("png", "pdf"):
+        pixels = estimate["width_in"] * estimate["height_in"] * dpi ** 2
+        if pixels > config.RENDER_MAX_PIXELS:
+            dpi = int((config.RENDER_MAX_PIXELS / (estimate["width_in"] * estimate["height_in"])) ** 0.5)
+
+    return spec, dpi, estimate
+
+def _lost_before():
+    # Queued for the queue timeout, then rendering for the render timeout
+    return time.time() - config.RENDER_QUEUE_TIMEOUT_SECONDS - config.RENDER_TIMEOUT_SECONDS - 60
+
+def in_flight(conn=None):
+    """Estimated cost and number of the renders running in any process"""
+    conn = conn or get_coordination()
+    cost, running = conn.execute(
+        "SELECT COALESCE(SUM(cost), 0), COUNT(*) FROM render_admissions WHERE state = 'running' AND started > ?",
+        (_lost_before(),)
+    ).fetchone()
+    return cost, running
+
+@contextmanager
+def admit(owner, cost):
+    """
+    Hold a render to the per-session and global limits while it runs.
+
+    A session may have RENDER_MAX_PER_SESSION renders running or queued, more
+    are refused straight away. Renders queue for RENDER_QUEUE_TIMEOUT_SECONDS
+    until the estimated cost in flight leaves room for theirs. A render
+    larger than the whole RENDER_BUDGET runs once nothing else does.
+    """
+    conn = get_coordination()
+    ticket = uuid.uuid4().hex
+    # Counted and taken in one statement, so two processes cannot both take
+    # the session's last slot
+    taken = conn.execute("""
+        INSERT INTO render_admissions (id, owner, cost, state, started)
+        SELECT ?, ?, ?, 'queued', ?
+        WHERE (SELECT COUNT(*) FROM render_admissions WHERE owner = ? AND started > ?) < ?
+    """, (ticket, owner, int(cost), time.time(), owner, _lost_before(), config.RENDER_MAX_PER_SESSION)).rowcount
+    if not taken:
+        with _budget:
+            admission_stats["rejected_session_limit"] += 1
+        raise AdmissionError(
+            f"Too many plots rendering for this session (limit {config.RENDER_MAX_PER_SESSION}), "
+            f"wait for them to finish", 429)
+
+    try:
+        deadline = time.monotonic() + config.RENDER_QUEUE_TIMEOUT_SECONDS
+        with stage("admission_wait"):
+            while True:
+                # Same for the budget: the cost in flight is summed by the
+                # statement that starts this render
+                started = conn.execute("""
+                    UPDATE render_admissions SET state = 'running', started = :now
+                    WHERE id = :id AND (
+                        SELECT flight = 0 OR flight + :cost <= :budget FROM (
+                            SELECT COALESCE(SUM(cost), 0) AS flight FROM render_admissions
+                            WHERE state = 'running' AND started > :lost
+                        )
+                    )
+                """, {"lost": _lost_before(), "now": time.time(), "id": ticket, "cost": int(cost),
+                      "budget": config.RENDER_BUDGET}).rowcount
+                if started:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with _budget:
+                        admission_stats["rejected_busy"] += 1
+                    raise AdmissionError("The server is busy rendering other plots, try again in a moment", 503)
+                with _budget:
+                    _budget.wait(min(remaining, ADMISSION_POLL_SECONDS))
+        yield
+    finally:
+        try:
+            conn.execute("DELETE FROM render_admissions WHERE id = ?", (ticket,))
+        except sqlite3.Error as e:
+            # The ticket stops counting once its render would have timed out
+            print(f"Admission release error: {e}")
+        with _budget:
+            _budget.notify_all()
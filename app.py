@@ -1,30 +1,43 @@
 from helpers import (
-    drop_table, wrap_labels, plotnine_to_svgString_dynasize,
-    remove_colname_upto_symbol, table_timestamp,
-    get_discrete_cmap_colors, init_db, check_session_tables
+    drop_table, table_timestamp, init_db, check_session_tables,
+    write_frame, create_melt_view, write_view_summary, update_melt_view,
+    write_compact_melt, read_session_table, read_table_page, melt_format, update_melt,
+    write_summary, read_summary,
+    index_columns, table_columns, filter_frame, read_levels,
+    render_cache, render_cache_key, frame_cache, cached_frame, frame_cache_key, invalidate_table_caches,
+    upload_hash, acquire_table, release_table, touch_table
 )                    
-from flask import Flask, render_template, redirect, request, jsonify, session
-import pandas as pd
-from io import StringIO
+from cell_stats import SUMMARY_STATS, plot_keys, summary_cells, discrete_levels, get_discrete_cmap_colors
+from preprocess import UploadPlan
+from render_pool import run_render, RenderError, pool
+from admission import plan_render, plot_note, admit, AdmissionError, admission_stats, in_flight
+from render_jobs import jobs
+from db import get_connection, transaction
+from expiry import start_expiry_scheduler, sweep_stats
+from metrics import (
+    stage, record_stage, drain_stages, server_timing_header, render_prometheus,
+    request_seconds, rows_processed, output_bytes
+)
+from flask import Flask, Response, g, render_template, redirect, request, jsonify, session
 import sqlite3
 import uuid
+import gzip
+import json
+import io
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import cProfile
 from datetime import timezone, datetime, timedelta
-import matplotlib
-matplotlib.use("Agg")
-from plotnine import (
-    ggplot, aes,
-    geom_jitter, geom_boxplot, geom_col,
-    position_jitterdodge, position_dodge,
-    scale_x_discrete,
-    facet_grid,
-    guides, guide_legend,
-    theme_classic, theme,
-    element_rect, element_text, element_blank,
-    scale_fill_manual
-) 
-import threading
 import config
 
+if config.SECRET_KEY is None:
+    raise ImportError(
+        "secretsconfig.py not found! Rename secrets.example.py to secretsconfig.py and configure it."
+    )
+
 # Configure application
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
@@ -33,14 +46,52 @@ app.config['SESSION_COOKIE_SECURE'] = False # Set True if using HTTPS
 
 # Global variables
 DB_PATH = config.DATABASE_PATH
-CLEANUP_INTERVAL_MINUTES = 10
-last_cleanup_time = None  
-cleanup_lock = threading.Lock()  # Prevents simultaneous cleanup
 
 
 # Initialize table_lifetime if not exists
 init_db()
 
+# Drop expired tables in the background, off the request path
+start_expiry_scheduler()
+
+# pandas and plotnine load on first use so lightweight routes come up fast,
+# PRELOAD_PLOTTING pays for them at startup instead of on the first graph
+if config.PRELOAD_PLOTTING:
+    if config.RENDER_POOL_ENABLED:
+        # Workers warm up in the background as soon as they are spawned
+        pool.start()
+    else:
+        import plotting
+        plotting.warm_up()
+
+@app.before_request
+def start_request_timer():
+    # Stage timings of this request are collected for its Server-Timing header
+    drain_stages()
+    g.request_start = time.perf_counter()
+
+    # Optional per-request profile: ?profile=1 when PROFILING_ENABLED
+    if config.PROFILING_ENABLED and request.args.get("profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def report_request_timing(response):
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    request_seconds.observe(request.endpoint or "unknown", elapsed)
+
+    timings = drain_stages() + [("total", elapsed)]
+    response.headers["Server-Timing"] = server_timing_header(timings)
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        path = os.path.join(config.PROFILE_DIR, f"{request.endpoint}-{time.time():.0f}-{uuid.uuid4().hex[:4]}.prof")
+        profiler.dump_stats(path)
+        response.headers["X-Profile-File"] = path
+    return response
+
 @app.before_request
 def cleanup_expired_tables():
 
@@ -71,59 +122,8 @@ def cleanup_expired_tables():
             session.clear()
             return
 
-    global last_cleanup_time
-    now = datetime.now(timezone.utc).isoformat()
-
-    if last_cleanup_time:
-        time_since_cleanup = (datetime.fromisoformat(now) - datetime.fromisoformat(last_cleanup_time)).total_seconds() / 60  # Convert to minutes
-        if time_since_cleanup < CLEANUP_INTERVAL_MINUTES:
-            return
-        
-    # Acquire lock to prevent race conditions
-    if not cleanup_lock.acquire(blocking=False):
-        return
-    
-    try: 
-        last_cleanup_time = now
-        
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.row_factory = sqlite3.Row
-                cur = conn.cursor()
-                # Get all expired table IDs
-                cur.execute("""
-                    SELECT id
-                    FROM table_lifetime
-                    WHERE julianday(Created) < julianday('now', '-2 hours')
-                """)
-                
-                expired_ids = [row["id"] for row in cur.fetchall()]
-                
-                if not expired_ids:
-                    return
-                
-                # Drop tables for each expired ID
-                for table_id in expired_ids:
-                    cur.execute(f"DROP TABLE IF EXISTS {table_id}")
-                
-                # Remove from tracking table
-                cur.executemany(
-                    "DELETE FROM table_lifetime WHERE id = ?",
-                    [(table_id,) for table_id in expired_ids]
-                )
-                
-                conn.commit()
-                print(f"Cleaned up {len(expired_ids)} expired tables")
-                
-        except sqlite3.Error as e:
-            print(f"Cleanup database error: {e}")
-        except Exception as e:
-            print(f"Cleanup error: {e}")
-    
-    finally:
-        cleanup_lock.release()
+    # Expired tables of other sessions are dropped by the expiry scheduler
 
-    
 
 @app.route('/')
 def start():
@@ -159,48 +159,14 @@ def file():
         
         if file_size > config.MAX_FILE_SIZE_BYTES:
             return render_template("start.html", 
-                error=f"File too large. File size: {file_size / (1024 * 1024)} MB. Maximum size: {config.MAX_FILE_SIZE_BYTES} MB")
+                error=f"File too large. File size: {file_size / (1024 * 1024)} MB. Maximum size: {config.MAX_FILE_SIZE_MB} MB")
         
         if file_size == 0:
             return render_template("start.html", error="File is empty")
         
-         # If session already had a table, delete it first
-        old_table = session.get("table_name")
-        drop_table(old_table)
-        
-        # Create a new unique table name for this user/session
-        table_name = "csv_" + uuid.uuid4().hex[:8]
-
-        # Read csv
-        try:
-            data = pd.read_csv(StringIO(infile.read().decode('utf-8')))
-        except UnicodeDecodeError:
-            return render_template("start.html", 
-                error="File encoding error. Please ensure file is UTF-8 encoded")
-        except pd.errors.EmptyDataError:
-            return render_template("start.html", error="CSV file is empty")
-        except pd.errors.ParserError as e:
-            return render_template("start.html", 
-                error=f"CSV parsing error: {str(e)}")
-        except Exception as e:
-            return render_template("start.html", 
-                error=f"File read error: {str(e)}")
-        
-        # Validate data
-        if data.empty:
-            return render_template("start.html", error="File contains no data")
-        if len(data.columns) < 2:
-            return render_template("start.html", error="File must have at least 2 columns")
-
-        ## Processing:
-        # Convert to data frame
-        dat = pd.DataFrame(data)
-        # Change first column name to ID
-        dat.rename(columns={dat.columns[0]: "Identifier"}, inplace=True)
-        # Remove .fcs from ID column
-        dat["Identifier"] = dat["Identifier"].str.replace(".fcs", "", regex=False)
-
-        # Split IDs
+        # Read preprocessing options up front, they are applied to every chunk
+        split_cols = None
+        Split_symbol = None
         if request.form.get("split_ids") == "on":
             user_cols = request.form.get("splitID_columns")
             Split_symbol = request.form.get("splitID_separator")
@@ -212,50 +178,102 @@ def file():
                 return render_template("start.html", 
                     error="Split ID enabled but no separator symbol provided")
             
-            New_IdCols = [x.strip() for x in user_cols.split(",") if x.strip()]
-            Number_newCols = len(New_IdCols) - 1
-            
-            try:
-                dat[New_IdCols] = dat["Identifier"].str.split(Split_symbol, n=Number_newCols, expand=True)
-            except Exception as e:
-                return render_template("start.html", 
-                error=f"ID Column Splitting Error: New column names must match number of splits. {str(e)}")
-
-            # Move to beginning
-            cols = ["Identifier"] + New_IdCols + [c for c in dat.columns if c not in New_IdCols + ["Identifier"]]
-            dat = dat[cols]
-
-        # Clean FlowJo export
-        if request.form.get("flowjo") == "on":
-            # Remove FlowJo Mean/SD last rows
-            dat = dat[~dat['Identifier'].str.strip().isin(['Mean', 'SD'])]
-            ## Clean-up suffix
-            dat.columns = [col.replace('Freq. of ', '') for col in dat.columns]
-            # Clean-up column names
-            prefix_remove = request.form.get("prefix_remove")
-            try:
-                prefix_number = int(prefix_remove)
-            except ValueError:
-                prefix_number = 0 
+            split_cols = [x.strip() for x in user_cols.split(",") if x.strip()]
 
-            for i in range(prefix_number):
-                dat = remove_colname_upto_symbol(dat, "/")
+        flowjo = request.form.get("flowjo") == "on"
+        try:
+            prefix_number = int(request.form.get("prefix_remove"))
+        except (TypeError, ValueError):
+            prefix_number = 0
 
-        
-        preview = dat.head()
-        colnames = dat.columns.tolist()
-        
-        #Add table to database
+        # Identical bytes with identical options give an identical table
+        with stage("hash"):
+            content_hash = upload_hash(infile.stream, (split_cols, Split_symbol, flowjo, prefix_number))
+
+        old_table = session.get("table_name")
+        # A melt view would be left pointing at the dropped table
+        drop_table(session.pop("filtered_table", None))
+
+        # Imported on first use, see PRELOAD_PLOTTING
+        import pandas as pd
+
+        # Stream the csv in chunks: clean each chunk and append it to the new
+        # table inside one transaction, so memory stays bounded by the chunk size
+        preview = None
+        colnames = None
+        n_rows = 0
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                dat.to_sql(table_name, conn, index=False, if_exists="replace")
-                 #Add table timestamp to table_lifetime
-                table_timestamp(table_name)
-                conn.commit()
-        except sqlite3.Error as e:
-            drop_table(table_name)  # Clean up
-            return render_template("start.html", 
-                error=f"Database error: {str(e)}")
+            # Parsing, cleaning and writing interleave chunk by chunk, their
+            # times are summed per stage
+            timings = {"parse": 0.0, "clean": 0.0, "to_sql": 0.0}
+            with transaction() as conn:
+                # Looked up under the write lock, so concurrent duplicate
+                # uploads ingest once and share the table
+                table_name = acquire_table(conn, content_hash)
+
+                # Release the session's previous upload, it is dropped once no
+                # other session shares it
+                drop_table(old_table)
+
+                if table_name is not None:
+                    colnames = table_columns(conn, table_name)
+                    preview = pd.read_sql(f"SELECT * FROM {table_name} LIMIT 5", con=conn)
+                else:
+                    # Create a new unique table name for this user/session
+                    table_name = "csv_" + uuid.uuid4().hex[:8]
+
+                    plan = None
+                    start = time.perf_counter()
+                    reader = pd.read_csv(infile.stream, encoding="utf-8", chunksize=config.UPLOAD_CHUNK_ROWS)
+                    for chunk in reader:
+                        timings["parse"] += time.perf_counter() - start
+                        if colnames is None and len(chunk.columns) < 2:
+                            raise ValueError("File must have at least 2 columns")
+
+                        ## Processing: compiled once from the header, applied to every chunk
+                        start = time.perf_counter()
+                        if plan is None:
+                            plan = UploadPlan(chunk.columns, split_cols=split_cols, split_symbol=Split_symbol,
+                                              flowjo=flowjo, prefix_number=prefix_number)
+                        dat = plan.apply(chunk)
+                        timings["clean"] += time.perf_counter() - start
+
+                        #Add chunk to database, creating the table with the first one
+                        start = time.perf_counter()
+                        write_frame(conn, table_name, dat, create=colnames is None)
+                        timings["to_sql"] += time.perf_counter() - start
+                        start = time.perf_counter()
+                        if colnames is None:
+                            colnames = dat.columns.tolist()
+                        if preview is None and not dat.empty:
+                            preview = dat.head()
+                        n_rows += len(dat)
+
+                    # Validate data
+                    if n_rows == 0:
+                        raise ValueError("File contains no data")
+                    plan.finish()
+
+                    #Add table timestamp and content hash to table_lifetime
+                    table_timestamp(table_name, content_hash)
+
+                    for name, seconds in timings.items():
+                        record_stage(name, seconds)
+                    rows_processed.observe("upload", n_rows)
+        except Exception as e:
+            if isinstance(e, UnicodeDecodeError):
+                error = "File encoding error. Please ensure file is UTF-8 encoded"
+            elif isinstance(e, pd.errors.EmptyDataError):
+                error = "CSV file is empty"
+            elif isinstance(e, pd.errors.ParserError):
+                error = f"CSV parsing error: {str(e)}"
+            elif isinstance(e, sqlite3.Error):
+                error = f"Database error: {str(e)}"
+            elif isinstance(e, ValueError):
+                error = str(e)
+            else:
+                error = f"File read error: {str(e)}"
+            return render_template("start.html", error=error)
 
         # Store metadata in the session
         session["table_name"] = table_name
@@ -288,37 +306,92 @@ def cols():
     if not original_table:
         return jsonify({"Error": "Mising table"}), 400
     
-    # Delete old filtered table if present
-    old_filtered = session.get("filtered_table")
-    drop_table(old_filtered)
-    
     # Create filtered table name
     filtered_table = "filtered_" + uuid.uuid4().hex[:8]
+
+    # Same id columns: only the added and removed markers' Vars slices
+    # change. A melted table is appended to, so it also needs the kept
+    # markers in their old order, a view is rebuilt in any order
+    old_filtered = session.get("filtered_table")
+    old_continuous = session.get("continuous_cols") or []
+    kept = [c for c in old_continuous if c in continuous]
+    added = [c for c in continuous if c not in old_continuous]
+    removed = [c for c in old_continuous if c not in continuous]
+    incremental = (old_filtered and categorical == session.get("categorical_cols")
+                   and (config.MELT_MODE == "view" or continuous == kept + added))
     
     # Convert list to comma-separated string for SQL
     columns_sql = ", ".join(f'"{c}"' for c in all_cols)
     
     # Read the data into pandas
+    import pandas as pd
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-        # Select the filtered columns
-            query = f"""SELECT {columns_sql} FROM {original_table}"""
-            df = pd.read_sql(query, con=conn)
-            
-            # Melt the dataframe using categorical as id_vars
-            mdf = df.melt(id_vars=categorical, var_name="Vars")
-            
-            # Save melted dataframe to database as filtered_table
-            mdf.to_sql(filtered_table, con=conn, if_exists='replace', index=False)
-            conn.commit()
+        with stage("melt"), transaction() as conn:
+            updated = False
+            if incremental and melt_format(conn, old_filtered) == config.MELT_MODE:
+                if continuous == old_continuous:
+                    # Nothing changed, keep the table and its cached renders
+                    filtered_table = old_filtered
+                    updated = True
+                elif config.MELT_MODE == "view":
+                    # Kept markers' summary cells are reused, only added ones
+                    # are read. A view without a summary is rebuilt below
+                    summary = update_melt_view(conn, old_filtered, filtered_table, original_table,
+                                               categorical, continuous)
+                    updated = summary is not None
+                    if updated:
+                        cached_frame(filtered_table, "summary", lambda: summary)
+                        touch_table(conn, original_table)
+                        invalidate_table_caches(old_filtered)
+                else:
+                    update_melt(conn, old_filtered, filtered_table, original_table, categorical,
+                                added, removed, float32=config.MELT_VALUE_FLOAT32)
+                    invalidate_table_caches(old_filtered)
+                    updated = True
+            if not updated:
+                # Delete old filtered table if present
+                drop_table(old_filtered)
+
+                if config.MELT_MODE == "view":
+                    # Serve the long format as a view over the uploaded table,
+                    # filters on its id columns use the uploaded table's indexes
+                    create_melt_view(conn, filtered_table, original_table, categorical, continuous)
+                    index_columns(conn, original_table, categorical)
+                    # The view reads the uploaded table, which must not expire first
+                    touch_table(conn, original_table)
+
+                    # Built from the uploaded table's columns, renders never
+                    # load the whole view for it
+                    summary = write_view_summary(conn, filtered_table, original_table, categorical, continuous)
+                    cached_frame(filtered_table, "summary", lambda: summary)
+                else:
+                    # Select the filtered columns
+                    query = f"""SELECT {columns_sql} FROM {original_table}"""
+                    df = pd.read_sql(query, con=conn)
+                    
+                    # Melt the dataframe using categorical as id_vars
+                    mdf = df.melt(id_vars=categorical, var_name="Vars")
+                    rows_processed.observe("melt", len(mdf))
+                    
+                    # Save melted dataframe to database as filtered_table
+                    if config.MELT_MODE == "compact":
+                        write_compact_melt(conn, filtered_table, mdf, float32=config.MELT_VALUE_FLOAT32)
+                    else:
+                        write_frame(conn, filtered_table, mdf, create=True)
+
+                    # Per-cell statistics, read by renders instead of the rows
+                    summary = write_summary(conn, filtered_table, mdf)
+                    cached_frame(filtered_table, "summary", lambda: summary)
+                    # Filters on the label columns are index lookups
+                    index_columns(conn, filtered_table, categorical + ["Vars"])
+
+                # Committed together with the new table
+                table_timestamp(filtered_table)
     except sqlite3.Error as e:
         return jsonify({"Database Error": f"{str(e)}"}), 500
     except Exception as e:
         return jsonify({"Processing error": f"{str(e)}"}), 500
     
-
-    table_timestamp(filtered_table)
-    
     # Store filtered table and column info in session
     session["filtered_table"] = filtered_table
     session["categorical_cols"] = categorical
@@ -346,14 +419,8 @@ def graph():
             return render_template("start.html", 
                                  error="Your session has expired. Please upload your data again.")
         
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                filtered_table = session.get("filtered_table")
-                df = pd.read_sql(f"SELECT * FROM {filtered_table}", con=conn)
-        except sqlite3.Error as e:
-            return render_template("start.html", error=f"Error reading data: {str(e)}")
-        
-        return render_template("graph.html", table=df.to_html(index=False))
+        # The data preview is fetched page by page from /preview_data
+        return render_template("graph.html", preview=True)
 
     #POST request, graph generation
     else:
@@ -369,130 +436,316 @@ def graph():
         session.pop('fcols', None)
 
         # Get new selections
-        xaxis = request.form.get('X_Select') or "Vars"
-        frows = request.form.get('Yfacet_Select') or "."
-        fcols = request.form.get('Xfacet_Select') or "."
-        
-        # Load table
+        spec = plot_spec_from_form(request.form)
         filtered_table = session.get("filtered_table")
+        
+        # Serve a previous identical render from the cache
+        cache_key = render_cache_key(filtered_table, spec)
+        fig = render_cache.get(cache_key)
+        if fig is not None:
+            session["last_plot"] = spec
+            return render_template("graph.html", fig=fig)
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                if filtered_table:
-                    df = pd.read_sql(f"SELECT * FROM {filtered_table}", con=conn)
+            fig = load_and_render(filtered_table, spec, cache_key)
+        except AdmissionError as e:
+            return render_template("graph.html", preview=True, error=str(e)), e.status
+        except RenderError as e:
+            return render_template("graph.html",
+            preview=True,
+            error=f"Error generating graph: {str(e)}")
         except Exception as e:
             return render_template("graph.html", error=f"Error reading data: {str(e)}")
-        
-        group = request.form.get('group_Select') or "Vars"
-        facet = f"{frows}~{fcols}"
 
-        # Generate colors
-        palette = request.form.get('palette')
-        n_groups = df[group].nunique()
-        palette_colors = get_discrete_cmap_colors(n_groups, cmap=palette)
+        # Remembered for /download_plot
+        session["last_plot"] = spec
+
+        return render_template("graph.html", fig=fig)
+
+def plot_spec_from_form(form):
+    """Collect the graph form selections into a render spec"""
+    return {
+        "xaxis": form.get('X_Select') or "Vars",
+        "frows": form.get('Yfacet_Select') or ".",
+        "fcols": form.get('Xfacet_Select') or ".",
+        "group": form.get('group_Select') or "Vars",
+        "palette": form.get('palette'),
+        # Read the graph type button
+        "graph_type": form.get('Graph_type'),
+        # Bar chart aggregation: "mean" or "median", error bars "none", "sd" or "sem"
+        "bar_stat": form.get('bar_stat') or "mean",
+        "error_bars": form.get('error_bars') or "none",
+        # Labels to keep per column, sorted so equal filters share a cache key
+        "filters": {key[len("filter:"):]: sorted(form.getlist(key))
+                    for key in sorted(form) if key.startswith("filter:") and form.getlist(key)},
+    }
+
+def filter_levels():
+    """Labels offered by the graph form's filter lists, for graph.html"""
+    filtered_table = session.get("filtered_table")
+    if not filtered_table:
+        return {}
+    try:
+        return read_levels(get_connection(), filtered_table, session.get("melt_cols", []), config.FILTER_MAX_LEVELS,
+                           source_table=session.get("table_name"), markers=session.get("continuous_cols"))
+    except sqlite3.Error:
+        return {}
+
+app.jinja_env.globals["filter_levels"] = filter_levels
+
+def load_plot_summary(filtered_table, spec):
+    """
+    The cell summary a render of spec needs, limited to the spec's filters.
+
+    Returns (summary, rows). A melt view left without a summary gets it built
+    and stored by the first render, rows is then every row it read to build
+    it, for load_plot_rows() to reuse, else None.
+    """
+    conn = get_connection()
+    filters = spec.get("filters") or {}
+
+    # Rows read to build a summary
+    loaded = {}
+
+    # Both the summary and the rows come from the frame cache when they can,
+    # so repeated plots of a session do not read SQLite
+    def load_summary():
+        summary = read_summary(conn, filtered_table)
+        if summary is not None:
+            return summary
+        # A melt view without a summary: it is built from every row. Renders
+        # in this process wait on the cache key, other processes on the write
+        # lock, and whoever comes second finds the stored summary
+        df = loaded["rows"] = cached_frame(filtered_table, "rows", lambda: read_session_table(conn, filtered_table))
+        with transaction() as tx:
+            summary = read_summary(tx, filtered_table)
+            if summary is None:
+                summary = write_summary(tx, filtered_table, df, create=True)
+        return summary
+
+    summary = cached_frame(filtered_table, "summary", load_summary)
+
+    keys = [c for c in summary.columns if c not in SUMMARY_STATS]
+    unknown = [col for col in filters if col not in keys]
+    if unknown:
+        raise ValueError(f"Unknown filter column: {', '.join(unknown)}")
+    # Every filter column is a cell key, so filtering cells is exact
+    summary = filter_frame(summary, filters)
+    if summary.empty:
+        raise ValueError("No data matches the selected filters")
+    return summary, loaded.get("rows")
+
+def load_plot_rows(filtered_table, spec, summary, extra_columns=(), rows=None):
+    """
+    The melted rows a render of spec needs, or None for bar charts the summary covers.
+
+    Only the plotted columns (plus extra_columns) of the rows passing the
+    spec's filters are read. rows is the whole table when it is already
+    loaded, see load_plot_summary().
+    """
+    if (spec["graph_type"] != "Boxplot"
+            and summary_cells(summary, plot_keys(spec), spec.get("bar_stat") or "mean") is not None):
+        return None
+
+    conn = get_connection()
+    filters = spec.get("filters") or {}
+    columns = list(dict.fromkeys(plot_keys(spec) + list(extra_columns))) + ["value"]
+
+    def load_rows():
+        # Filter and project the whole table when it is loaded, else push both into SQL
+        whole = rows
+        if whole is None:
+            whole = frame_cache.get(frame_cache_key(filtered_table, "rows"))
+        if whole is not None:
+            return filter_frame(whole, filters)[columns]
+        return read_session_table(conn, filtered_table, columns, filters)
+
+    return cached_frame(filtered_table, "rows", load_rows, filters, columns)
+
+def load_and_render(filtered_table, spec, cache_key, progress=None, format="svg", dpi=config.PLOT_RASTER_DPI):
+    """Load the melted table, render spec in the worker pool and cache the result"""
+    if progress:
+        progress("loading")
+    summary, rows = load_plot_summary(filtered_table, spec)
+    # Refuse or simplify plots too large to render, from the summary alone
+    render_spec, dpi, estimate = plan_render(summary, spec, format, dpi)
+
+    # Read the rows and render in the worker pool, off the request thread,
+    # once the session and the global render budget allow it
+    with admit(filtered_table, estimate["cost"]):
+        df = load_plot_rows(filtered_table, spec, summary, rows=rows)
+        if progress:
+            progress("rendering")
+        with stage("render"):
+            fig = run_render("plotting.render_graph", df, render_spec, format, dpi, summary)
+
+    size = len(fig) if isinstance(fig, bytes) else len(fig.encode("utf-8"))
+    output_bytes.observe(format, size)
+    render_cache.put(cache_key, fig, size, table=filtered_table)
+    return fig
+
+@app.route('/graph/submit', methods=["POST"])
+def graph_submit():
+    ##Check session tables
+    if not check_session_tables() or not session.get("filtered_table"):
+        return jsonify({"Error": "Your session has expired. Please upload your data again."}), 400
+    session['last_active'] = datetime.now(timezone.utc).isoformat()
 
-        try:
-            custom_theme = theme_classic() + theme(
-                plot_background=element_rect(fill='none'),
-                panel_background=element_rect(fill='none'),
-                legend_background=element_rect(fill='none'),
-                legend_key=element_rect(fill='none', color='none'),
-                legend_text=element_text(size=8),           # Legend item text size
-                legend_title=element_text(size=8),
-                axis_text_x=element_text(angle=90, ha='right', size=9, color='black'),
-                axis_text_y=element_text(size=9, color='black'),
-                axis_title_y=element_blank()
-            )
-
-            if xaxis == 'Vars':
-                custom_theme = custom_theme + theme(axis_title_x=element_blank())
-
-            # Read the graph type button
-            type = request.form.get('Graph_type')
-
-            if type == 'Boxplot':
-                graph = (ggplot(df, aes(x=xaxis, y="value", fill=group)) + 
-                        geom_jitter(size=1.75, position=position_jitterdodge(jitter_width=0.1, dodge_width=0.6)) + 
-                        geom_boxplot(width=0.4, alpha=0.2, color='black',
-                                    position=position_dodge(width=0.6), 
-                                    show_legend=False, outlier_shape='') + 
-                        scale_x_discrete(limits=df[xaxis].unique(), labels=wrap_labels) + 
-                        guides(fill=guide_legend(override_aes={'size': 4})) +
-                        scale_fill_manual(values=palette_colors) +
-                        custom_theme)
-            else:
-                graph = (ggplot(df, aes(x=xaxis, y="value", fill=group)) + 
-                        geom_col(width=0.6, color='black',
-                                    position=position_dodge(width=0.8)) + 
-                        scale_x_discrete(limits=df[xaxis].unique(),labels=wrap_labels) + 
-                        guides(fill=guide_legend(override_aes={'size': 0.5})) +
-                        scale_fill_manual(values=palette_colors) +
-                        custom_theme)
+    spec = plot_spec_from_form(request.form)
+    filtered_table = session.get("filtered_table")
+    cache_key = render_cache_key(filtered_table, spec)
+    session["last_plot"] = spec
 
-            
+    fig = render_cache.get(cache_key)
+    if fig is not None:
+        job = jobs.finished(cache_key, filtered_table, spec)
+    else:
+        # Double submits of the same plot join the running job
+        job = jobs.submit(cache_key, filtered_table, spec,
+                          lambda progress: load_and_render(filtered_table, spec, cache_key, progress))
+
+    return jsonify({"job_id": job.id, "status": job.status})
+
+@app.route('/graph/status/<job_id>')
+def graph_status(job_id):
+    job = jobs.get(job_id)
+    if job is None or job.owner != session.get("filtered_table"):
+        return jsonify({"Error": "Unknown render job"}), 404
+    status = job.to_dict()
+    if job.status == "done":
+        fig = render_cache.get(job.key)
+        if fig is None:
+            # Rendered by another process, or evicted since
+            try:
+                fig = load_and_render(job.owner, job.spec, job.key)
+            except AdmissionError as e:
+                return jsonify({**status, "status": "error", "error": str(e)}), e.status
+            except Exception as e:
+                return jsonify({**status, "status": "error", "error": str(e)})
+        status["fig"] = fig
+    return jsonify(status)
+
+@app.route('/plot_data', methods=["POST"])
+def plot_data():
+    """Geometry of the graph form's plot as JSON, drawn by the browser instead of plotnine"""
+    ##Check session tables
+    if not check_session_tables() or not session.get("filtered_table"):
+        return jsonify({"Error": "Your session has expired. Please upload your data again."}), 400
+    session['last_active'] = datetime.now(timezone.utc).isoformat()
 
-            # Only add facet_grid if one facet variable exists
-            if frows != "." or fcols != ".":
-                facet = f"{frows}~{fcols}"
-                graph = graph + facet_grid(facet, scales='free')
-            
-            
-            # Plot to custom size
-            fig = plotnine_to_svgString_dynasize(p=graph, df=df, group=group, n_groups=n_groups,
-                                                x_col = xaxis, 
-                                                row_var=frows, 
-                                                col_var=fcols)
+    spec = plot_spec_from_form(request.form)
+    filtered_table = session.get("filtered_table")
+    # The browser applies the palette, every palette shares the geometry
+    cache_key = render_cache_key(filtered_table, {**spec, "palette": None, "format": "json"})
 
-            return render_template("graph.html", fig=fig)
-        
+    geometry = render_cache.get(cache_key)
+    if geometry is None:
+        try:
+            # Admitted like a server side render, before any rows are read
+            summary, rows = load_plot_summary(filtered_table, spec)
+            _, _, estimate = plan_render(summary, spec)
+            with admit(filtered_table, estimate["cost"]):
+                df = load_plot_rows(filtered_table, spec, summary, rows=rows)
+                with stage("geometry"):
+                    geometry = json.dumps(run_render("plotting.plot_geometry", df, spec, summary))
+        except AdmissionError as e:
+            return jsonify({"Error": str(e)}), e.status
+        except RenderError as e:
+            return jsonify({"Error": f"Error generating graph: {str(e)}"}), 500
         except Exception as e:
-            return render_template("graph.html",
-            table=df.to_html(index=False),
-            error=f"Error generating graph: {str(e)}")
+            return jsonify({"Error": f"Error reading data: {str(e)}"}), 400
+        output_bytes.observe("json", len(geometry))
+        render_cache.put(cache_key, geometry, len(geometry), table=filtered_table)
+
+    # Remembered for /download_plot, which renders it server side
+    session["last_plot"] = spec
+    return Response(geometry, mimetype="application/json")
+
+@app.route('/plot_colors')
+def plot_colors():
+    """Fill colors of a browser plot, recolored on a palette change without reloading its geometry"""
+    palette = request.args.get("palette", "")
+    try:
+        n_colors = int(request.args.get("n", 0))
+    except ValueError:
+        return jsonify({"Error": "n must be an integer"}), 400
+    if not 0 < n_colors <= config.CLIENT_MAX_COLORS:
+        return jsonify({"Error": f"n must be between 1 and {config.CLIENT_MAX_COLORS}"}), 400
+    try:
+        colors = get_discrete_cmap_colors(n_colors, cmap=palette)
+    except ValueError:
+        return jsonify({"Error": f"Unknown palette: {palette}"}), 400
+
+    # /download_plot renders the plot as now colored
+    if session.get("last_plot"):
+        session["last_plot"] = {**session["last_plot"], "palette": palette}
+    return jsonify(colors)
+
+@app.route('/preview_data')
+def preview_data():
+    filtered_table = session.get("filtered_table")
+    if not filtered_table:
+        return jsonify({"Error": "Mising table"}), 400
 
-@app.route('/delete')
-def delete():
-    table = session.get("table_name")
+    # Page window, capped so one request cannot pull the whole table
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            c = conn.cursor()
-            table_exists = c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchall()
-    except Exception as e:
-        table_delete_message = f"No data could be found in this session. Error: {str(e)}."
-                         
-    if table_exists:
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute(f"DROP TABLE IF EXISTS {table}")
-                conn.execute(f"DELETE FROM table_lifetime WHERE id = ?", (table,))
-                conn.commit()
-                
-                table_delete_message = "Uploaded Table Succesfully Deleted !"
-        except Exception as e:
-            table_delete_message = f"Error deleting table: {str(e)}."
-    else:
-        table_delete_message = "No data could be found in this session."
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = int(request.args.get("limit", config.PREVIEW_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"Error": "offset and limit must be integers"}), 400
+    limit = min(max(1, limit), config.PREVIEW_MAX_PAGE_SIZE)
+    columns = request.args.getlist("columns")
 
+    try:
+        columns, rows, has_more = read_table_page(get_connection(), filtered_table, columns, limit, offset)
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"Database Error": f"{str(e)}"}), 500
 
+    return jsonify({
+        "columns": columns,
+        "rows": rows,
+        "offset": offset,
+        "next_offset": offset + len(rows) if has_more else None
+    })
+
+@app.route('/delete')
+def delete():
+    table = session.get("table_name")
     filt_table = session.get("filtered_table") 
+    dropped = []
+
+    # Drop both session tables in one transaction
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            c = conn.cursor()
-            filttable_exists = c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (filt_table,)).fetchall()
+        with transaction() as conn:
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name IN (?, ?)",
+                (table, filt_table)
+            )}
+            # An upload shared with other sessions only loses this reference
+            dropped = [name for name in (table, filt_table) if name in existing and release_table(conn, name)]
+
+        if table in dropped:
+            table_delete_message = "Uploaded Table Succesfully Deleted !"
+        elif table in existing:
+            table_delete_message = "Uploaded Table Removed From This Session ! Other sessions still use it, so it is kept."
+        else:
+            table_delete_message = "No data could be found in this session."
+
+        if filt_table in dropped:
+            filttable_delete_message = "Filtered Table Succesfully Deleted !"
+        elif filt_table in existing:
+            filttable_delete_message = "Filtered Table Removed From This Session ! Other sessions still use it, so it is kept."
+        else:
+            filttable_delete_message = "No filtered data could be found in this session."
     except Exception as e:
-        filttable_delete_message = f"No filtered data could be found in this session. Error: {str(e)}."
-                         
-    if filttable_exists:
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute(f"DROP TABLE IF EXISTS {filt_table}")
-                conn.execute(f"DELETE FROM table_lifetime WHERE id = ?", (filt_table,))
-                conn.commit()
+        table_delete_message = f"Error deleting table: {str(e)}."
+        filttable_delete_message = f"Error deleting filtered table: {str(e)}"
 
-                filttable_delete_message = "Filtered Table Succesfully Deleted !"
-        except Exception as e:
-            filttable_delete_message = f"Error deleting filtered table: {str(e)}"
-    else:
-        filttable_delete_message = "No filtered data could be found in this session."
+    # Forget any renders and loaded frames of the deleted tables
+    for name in dropped:
+        invalidate_table_caches(name)
 
     # Clear all session data
     session.clear()
@@ -507,7 +760,190 @@ def usage():
 def about():
     return render_template("about.html")
 
+@app.route('/metrics')
+def metrics():
+    # Database file plus its write-ahead log
+    db_bytes = sum(os.path.getsize(path) for path in (DB_PATH, DB_PATH + "-wal") if os.path.exists(path))
+    cache = render_cache.stats()
+    frames = frame_cache.stats()
+    cost_in_flight, running = in_flight()
+    gauges = [
+        ("flowgraph_db_file_bytes", "gauge", "Size of the SQLite database and WAL", db_bytes),
+        ("flowgraph_render_cache_bytes", "gauge", "Bytes held by the render cache", cache["bytes"]),
+        ("flowgraph_render_cache_entries", "gauge", "Entries in the render cache", cache["entries"]),
+        ("flowgraph_render_cache_hits_total", "counter", "Render cache hits", cache["hits"]),
+        ("flowgraph_render_cache_misses_total", "counter", "Render cache misses", cache["misses"]),
+        ("flowgraph_render_cache_evictions_total", "counter", "Render cache evictions", cache["evictions"]),
+        ("flowgraph_frame_cache_bytes", "gauge", "Bytes held by the DataFrame cache", frames["bytes"]),
+        ("flowgraph_frame_cache_hits_total", "counter", "DataFrame cache hits", frames["hits"]),
+        ("flowgraph_frame_cache_misses_total", "counter", "DataFrame cache misses", frames["misses"]),
+        ("flowgraph_frame_cache_evictions_total", "counter", "DataFrame cache evictions", frames["evictions"]),
+        ("flowgraph_render_budget_in_flight", "gauge", "Estimated cost of renders in flight", cost_in_flight),
+        ("flowgraph_renders_running", "gauge", "Renders admitted and running", running),
+        ("flowgraph_renders_degraded_total", "counter", "Renders simplified to fit the limits", admission_stats["degraded"]),
+        ("flowgraph_renders_rejected_too_large_total", "counter", "Renders refused as too large", admission_stats["rejected_too_large"]),
+        ("flowgraph_renders_rejected_session_limit_total", "counter", "Renders refused by the per-session limit", admission_stats["rejected_session_limit"]),
+        ("flowgraph_renders_rejected_busy_total", "counter", "Renders refused after queueing for budget", admission_stats["rejected_busy"]),
+        ("flowgraph_expiry_sweeps_total", "counter", "Expiry sweeps run", sweep_stats["sweeps"]),
+        ("flowgraph_expiry_tables_dropped_total", "counter", "Tables dropped by expiry", sweep_stats["tables_dropped"]),
+        ("flowgraph_expiry_bytes_reclaimed_total", "counter", "Bytes reclaimed by expiry", sweep_stats["bytes_reclaimed"]),
+    ]
+    return Response(render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route('/render_cache_stats')
+def render_cache_stats():
+    return jsonify(render_cache.stats())
+
+# Export formats of /download_plot: mimetype and file extension
+DOWNLOAD_FORMATS = {
+    "svg": ("image/svg+xml", "svg"),
+    "svgz": ("application/gzip", "svgz"),
+    "pdf": ("application/pdf", "pdf"),
+    "png": ("image/png", "png"),
+}
+
 @app.route('/download_plot')
 def download_plot():
-    
-    return
\ No newline at end of file
+    spec = session.get("last_plot")
+    filtered_table = session.get("filtered_table")
+    if not spec or not filtered_table:
+        return render_template("graph.html", preview=True, error="Plot some data before downloading it")
+
+    fmt = (request.args.get("format") or "svg").lower()
+    if fmt not in DOWNLOAD_FORMATS:
+        return Response(f"Unknown download format: {fmt}", status=400, mimetype="text/plain")
+    try:
+        dpi = int(request.args.get("dpi", config.DOWNLOAD_DEFAULT_DPI))
+    except ValueError:
+        dpi = config.DOWNLOAD_DEFAULT_DPI
+    dpi = min(max(dpi, 50), config.DOWNLOAD_MAX_DPI)
+
+    # SVG and SVGZ come from the cached inline render, PDF and PNG are
+    # rendered once per dpi and cached under their own key
+    if fmt in ("svg", "svgz"):
+        cache_key = render_cache_key(filtered_table, spec)
+        render_format = "svg"
+    else:
+        cache_key = render_cache_key(filtered_table, {**spec, "format": fmt, "dpi": dpi})
+        render_format = fmt
+
+    # A repeat download is answered before touching the cache
+    etag = f"{cache_key}-{fmt}"
+    if etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    data = render_cache.get(cache_key)
+    if data is None:
+        try:
+            data = load_and_render(filtered_table, spec, cache_key, format=render_format, dpi=dpi)
+        except AdmissionError as e:
+            return render_template("graph.html", preview=True, error=str(e)), e.status
+        except RenderError as e:
+            return render_template("graph.html", preview=True, error=f"Error generating graph: {str(e)}")
+        except Exception as e:
+            return render_template("graph.html", error=f"Error reading data: {str(e)}")
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if fmt == "svgz":
+        # mtime=0 keeps the bytes, and so the ETag, stable between requests
+        data = gzip.compress(data, mtime=0)
+
+    mimetype, extension = DOWNLOAD_FORMATS[fmt]
+    response = Response(data, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=flow-graph.{extension}"
+    response.cache_control.private = True
+    response.set_etag(etag)
+    return response
+
+@app.route('/graph/batch', methods=["POST"])
+def graph_batch():
+    """One plot per value of split_by, as a gallery page or a zip of files"""
+    if not check_session_tables():
+        return render_template("start.html",
+                             error="Your session has expired. Please upload your data again.")
+
+    spec = plot_spec_from_form(request.form)
+    split_by = request.form.get("split_by") or "Vars"
+    output = request.form.get("batch_output") or "gallery"
+    if output != "gallery" and output not in ("svg", "pdf", "png"):
+        return render_template("graph.html", preview=True, error=f"Unknown batch output: {output}")
+    render_format = "svg" if output == "gallery" else output
+
+    try:
+        figs = render_batch(session.get("filtered_table"), spec, split_by,
+                            format=render_format, dpi=config.DOWNLOAD_DEFAULT_DPI)
+    except AdmissionError as e:
+        return render_template("graph.html", preview=True, error=str(e)), e.status
+    except RenderError as e:
+        return render_template("graph.html", preview=True, error=f"Error generating graph: {str(e)}")
+    except Exception as e:
+        return render_template("graph.html", preview=True, error=f"Error reading data: {str(e)}")
+
+    if output == "gallery":
+        return render_template("gallery.html", split_by=split_by, figs=figs)
+
+    buf = io.BytesIO()
+    names = set()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for value, fig in figs:
+            # Keep file names portable, values that clean up to the same
+            # name get a numbered suffix so no entry hides another
+            base = re.sub(r"[^\w.-]+", "_", str(value)).strip("_") or "plot"
+            name, n = base, 1
+            while name.lower() in names:
+                n += 1
+                name = f"{base}_{n}"
+            names.add(name.lower())
+            archive.writestr(f"{name}.{DOWNLOAD_FORMATS[output][1]}", fig)
+    response = Response(buf.getvalue(), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f"attachment; filename=flow-graph-{output}.zip"
+    return response
+
+def render_batch(filtered_table, spec, split_by, format="svg", dpi=config.PLOT_RASTER_DPI):
+    """
+    Load the melted table once and render one plot per value of split_by.
+
+    The values are dealt out to one chunk per render worker so the chunks
+    render in parallel, and each chunk builds its theme and palette once.
+    Returns a list of (value, figure) in order of appearance.
+    """
+    if split_by not in table_columns(get_connection(), filtered_table):
+        raise ValueError(f"Unknown column: {split_by}")
+    summary, rows = load_plot_summary(filtered_table, spec)
+
+    values = list(summary[split_by].dropna().unique())
+    if len(values) > config.BATCH_MAX_PLOTS:
+        raise ValueError(f"{split_by} has {len(values)} values, batches are limited to "
+                         f"{config.BATCH_MAX_PLOTS} plots")
+    # Colors come from every group level, in the order the single plots give
+    # them, so they match across the plots and with /graph
+    levels = discrete_levels(summary[spec["group"]])
+
+    # Every plot is checked, they all share the most simplified spec and the
+    # batch is admitted with their total cost. Each plot's caption tells
+    # what the shared spec leaves out of that plot
+    parts = list(summary.groupby(split_by, observed=True, sort=False))
+    planned = [plan_render(part, spec, format, dpi) for _, part in parts]
+    spec = min((p[0] for p in planned), key=lambda s: s.get("jitter_cap", float("inf")))
+    dpi = min(p[1] for p in planned)
+    cost = sum(p[2]["cost"] for p in planned)
+    notes = {value: plot_note(part, spec) for value, part in parts}
+
+    workers = config.RENDER_WORKERS if config.RENDER_POOL_ENABLED else 1
+    n_chunks = max(1, min(len(values), workers))
+    chunks = [values[i::n_chunks] for i in range(n_chunks)]
+
+    with admit(filtered_table, cost):
+        df = load_plot_rows(filtered_table, spec, summary, extra_columns=[split_by], rows=rows)
+        with stage("render"), ThreadPoolExecutor(max_workers=n_chunks) as executor:
+            futures = [executor.submit(run_render, "plotting.render_graph_batch",
+                                       None if df is None else df[df[split_by].isin(chunk)],
+                                       spec, split_by, levels, format, dpi,
+                                       summary[summary[split_by].isin(chunk)], notes)
+                       for chunk in chunks]
+            figs = dict(fig for future in futures for fig in future.result())
+
+    for fig in figs.values():
+        output_bytes.observe(format, len(fig) if isinstance(fig, bytes) else len(fig.encode("utf-8")))
+    return [(value, figs[value]) for value in values if value in figs]
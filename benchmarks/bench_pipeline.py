@@ -0,0 +1,216 @@
+"""
+Pipeline benchmark
+
+Times every stage of the upload -> melt -> plot pipeline on synthetic FlowJo
+exports of increasing size, both stage by stage through the helpers and end to
+end through the Flask test client, and prints the results as JSON so runs on
+different commits can be compared.
+
+    python benchmarks/bench_pipeline.py --tiers small,medium --output bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_flowjo import generate_flowjo_frame  # noqa: E402
+
+# name -> (rows, marker columns)
+TIERS = {
+    "small": (1_000, 10),
+    "medium": (10_000, 30),
+    "large": (100_000, 50),
+}
+GATE_DEPTH = 2
+ID_COLUMNS = ["Donor", "Condition", "Replicate"]
+CATEGORICAL = ["Donor", "Condition"]
+PLOT_SPEC = {
+    "xaxis": "Vars",
+    "frows": ".",
+    "fcols": ".",
+    "group": "Condition",
+    "palette": "GnBu",
+    "graph_type": "Boxplot",
+    "bar_stat": "mean",
+    "error_bars": "none",
+}
+
+
+@contextmanager
+def timer(results, stage):
+    start = time.perf_counter()
+    yield
+    results[stage] = round(time.perf_counter() - start, 6)
+
+
+def time_stages(csv_bytes):
+    """Run the pipeline steps one at a time, in-process, and time each"""
+    import pandas as pd
+    from db import transaction, get_connection
+    from helpers import write_frame, read_session_table, drop_table, init_db
+    from preprocess import UploadPlan
+    from plotting import build_graph, plotnine_to_svgString_dynasize
+
+    init_db()
+    stages = {}
+    with timer(stages, "parse"):
+        dat = pd.read_csv(io.BytesIO(csv_bytes))
+
+    # The same compiled cleanup /upload runs on every chunk
+    with timer(stages, "clean"):
+        dat = UploadPlan(dat.columns, split_cols=ID_COLUMNS, split_symbol="_", flowjo=True,
+                         prefix_number=GATE_DEPTH).apply(dat)
+
+    table = "bench_csv"
+    melted = "bench_filtered"
+    with timer(stages, "to_sql"):
+        with transaction() as conn:
+            drop_table(table)
+            write_frame(conn, table, dat, create=True)
+
+    markers = [c for c in dat.columns if c not in ["Identifier"] + ID_COLUMNS]
+    with timer(stages, "melt"):
+        mdf = dat[CATEGORICAL + markers].melt(id_vars=CATEGORICAL, var_name="Vars")
+
+    with timer(stages, "melt_to_sql"):
+        with transaction() as conn:
+            drop_table(melted)
+            write_frame(conn, melted, mdf, create=True)
+
+    with timer(stages, "read_sql"):
+        df = read_session_table(get_connection(), melted)
+
+    with timer(stages, "ggplot_build"):
+        graph, n_groups = build_graph(df, PLOT_SPEC)
+
+    with timer(stages, "svg_save"):
+        svg = plotnine_to_svgString_dynasize(p=graph, df=df, group=PLOT_SPEC["group"], n_groups=n_groups,
+                                             x_col=PLOT_SPEC["xaxis"], row_var=".", col_var=".")
+
+    drop_table(table)
+    drop_table(melted)
+    return stages, {"melted_rows": len(mdf), "svg_bytes": len(svg)}
+
+
+def time_endpoints(csv_bytes):
+    """Drive the Flask app end to end through its test client"""
+    import app as flow_app
+
+    client = flow_app.app.test_client()
+    endpoints = {}
+
+    with timer(endpoints, "upload"):
+        response = client.post("/upload", data={
+            "DataFile": (io.BytesIO(csv_bytes), "bench.csv"),
+            "split_ids": "on",
+            "splitID_columns": ", ".join(ID_COLUMNS),
+            "splitID_separator": "_",
+            "flowjo": "on",
+            "prefix_remove": str(GATE_DEPTH),
+        }, content_type="multipart/form-data")
+    assert response.status_code == 200, response.status_code
+
+    with client.session_transaction() as sess:
+        table = sess["table_name"]
+    from db import get_connection
+    columns = [row[1] for row in get_connection().execute(f"PRAGMA table_info({table})")]
+    continuous = [c for c in columns if c not in ["Identifier"] + ID_COLUMNS]
+
+    with timer(endpoints, "process_columns"):
+        response = client.post("/process_columns", json={"categorical": CATEGORICAL, "continuous": continuous})
+    assert response.status_code == 200, response.get_json()
+
+    with timer(endpoints, "graph_get"):
+        client.get("/graph")
+    with timer(endpoints, "preview_page"):
+        client.get("/preview_data")
+
+    form = {
+        "X_Select": PLOT_SPEC["xaxis"],
+        "group_Select": PLOT_SPEC["group"],
+        "palette": PLOT_SPEC["palette"],
+    }
+    for graph_type in ("Boxplot", "Bar"):
+        with timer(endpoints, f"graph_post_{graph_type.lower()}"):
+            response = client.post("/graph", data={**form, "Graph_type": graph_type})
+        assert b"<svg" in response.data, f"{graph_type} render failed"
+        # Second identical request is served from the render cache
+        with timer(endpoints, f"graph_post_{graph_type.lower()}_cached"):
+            client.post("/graph", data={**form, "Graph_type": graph_type})
+
+    client.get("/delete")
+    return endpoints
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Flow-Graph pipeline")
+    parser.add_argument("--tiers", default="small,medium", help=f"comma separated, from {', '.join(TIERS)}")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per tier, the fastest is reported")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--in-process", action="store_true", help="render without the worker pool")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before anything connects, and
+    # give it a session key so a checkout without secretsconfig can run
+    import config
+    tmpdir = tempfile.mkdtemp(prefix="flowgraph-bench-")
+    config.DATABASE_PATH = os.path.join(tmpdir, "bench.db")
+    config.SECRET_KEY = config.SECRET_KEY or "bench"
+    if args.in_process:
+        config.RENDER_POOL_ENABLED = False
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "tiers": [],
+    }
+    for name in args.tiers.split(","):
+        rows, markers = TIERS[name.strip()]
+        csv_bytes = generate_flowjo_frame(rows, markers, gate_depth=GATE_DEPTH).to_csv(index=False).encode("utf-8")
+
+        runs = []
+        for _ in range(args.repeat):
+            stages, sizes = time_stages(csv_bytes)
+            endpoints = time_endpoints(csv_bytes)
+            runs.append((stages, endpoints))
+
+        results["tiers"].append({
+            "name": name.strip(),
+            "rows": rows,
+            "markers": markers,
+            "csv_bytes": len(csv_bytes),
+            **sizes,
+            "stages": {k: min(run[0][k] for run in runs) for k in runs[0][0]},
+            "endpoints": {k: min(run[1][k] for run in runs) for k in runs[0][1]},
+        })
+        print(f"{name}: done", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
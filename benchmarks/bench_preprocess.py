@@ -0,0 +1,144 @@
+"""
+Upload preprocessing benchmark
+
+Compares the compiled UploadPlan with the earlier step-by-step cleanup (one
+whole-frame pass per step and one column rename pass per gate prefix) on
+wide synthetic FlowJo exports. Reports the fastest time and the peak memory
+allocated during the cleanup, measured with tracemalloc, as JSON.
+
+    python benchmarks/bench_preprocess.py --tiers wide,very_wide --repeat 3
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_flowjo import generate_flowjo_frame  # noqa: E402
+
+# name -> (rows, marker columns)
+TIERS = {
+    "narrow": (50_000, 20),
+    "wide": (10_000, 500),
+    "very_wide": (20_000, 2000),
+}
+GATE_DEPTH = 4
+OPTIONS = {
+    "split_cols": ["Donor", "Condition", "Replicate"],
+    "split_symbol": "_",
+    "flowjo": True,
+    "prefix_number": GATE_DEPTH,
+}
+
+
+def remove_colname_upto_symbol(df, symbol):
+    """Drop everything up to the first symbol from every column name, as helpers did"""
+    escaped = re.escape(symbol)
+    pattern = rf'^.*?{escaped}'
+    df.columns = df.columns.str.replace(pattern, '', regex=True)
+    return df
+
+
+def step_by_step(dat, split_cols=None, split_symbol=None, flowjo=False, prefix_number=0):
+    """The cleanup as /upload ran it before UploadPlan, one pass per step"""
+    dat = dat.rename(columns={dat.columns[0]: "Identifier"})
+    dat["Identifier"] = dat["Identifier"].str.replace(".fcs", "", regex=False)
+    if flowjo:
+        dat = dat[~dat['Identifier'].str.strip().isin(['Mean', 'SD'])]
+    if split_cols:
+        parts = dat["Identifier"].str.split(split_symbol, n=len(split_cols) - 1, expand=True)
+        if len(dat) and parts.shape[1] != len(split_cols):
+            raise ValueError(f"Expected {len(split_cols)} parts, found {parts.shape[1]}")
+        dat = dat.copy()
+        for i, col in enumerate(split_cols):
+            dat[col] = parts[i] if i in parts.columns else None
+        cols = ["Identifier"] + split_cols + [c for c in dat.columns if c not in split_cols + ["Identifier"]]
+        dat = dat[cols]
+    if flowjo:
+        dat.columns = [col.replace('Freq. of ', '') for col in dat.columns]
+        for _ in range(prefix_number):
+            dat = remove_colname_upto_symbol(dat, "/")
+    return dat
+
+
+def compiled_plan(dat, split_cols, split_symbol, flowjo, prefix_number):
+    from preprocess import UploadPlan
+
+    return UploadPlan(dat.columns, split_cols=split_cols, split_symbol=split_symbol,
+                      flowjo=flowjo, prefix_number=prefix_number).apply(dat)
+
+
+def measure(clean, raw, repeat):
+    """Fastest time over repeat runs, and the peak of a traced run in bytes"""
+    seconds = []
+    for _ in range(repeat):
+        dat = raw.copy()
+        start = time.perf_counter()
+        clean(dat, **OPTIONS)
+        seconds.append(time.perf_counter() - start)
+
+    dat = raw.copy()
+    tracemalloc.start()
+    out = clean(dat, **OPTIONS)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(min(seconds), 6),
+        "peak_bytes": peak,
+        "output_bytes": int(out.memory_usage(index=True, deep=True).sum()),
+    }
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Benchmark the upload preprocessing")
+    parser.add_argument("--tiers", default="narrow,wide", help=f"comma separated, from {', '.join(TIERS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per tier, the fastest is reported")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "tiers": [],
+    }
+    for name in args.tiers.split(","):
+        rows, markers = TIERS[name.strip()]
+        csv = generate_flowjo_frame(rows, markers, gate_depth=GATE_DEPTH).to_csv(index=False)
+        # Parsed like /upload does, so dtypes match a real chunk
+        raw = pd.read_csv(io.StringIO(csv))
+
+        before = measure(step_by_step, raw, args.repeat)
+        after = measure(compiled_plan, raw, args.repeat)
+        results["tiers"].append({
+            "name": name.strip(),
+            "rows": rows,
+            "markers": markers,
+            "step_by_step": before,
+            "upload_plan": after,
+            "speedup": round(before["seconds"] / after["seconds"], 2),
+            "peak_memory_ratio": round(after["peak_bytes"] / before["peak_bytes"], 2),
+        })
+        print(f"{name}: done", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Synthetic FlowJo table exports for benchmarks
+
+Writes CSVs shaped like a FlowJo table export: a sample column of .fcs file
+names built from ID parts, gated marker columns such as
+"Lymphocytes/Single Cells/CD4 | Freq. of Parent", and the Mean/SD footer rows
+FlowJo appends.
+
+    python benchmarks/synthetic_flowjo.py out.csv --rows 10000 --markers 40
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+GATE_PATH = ["Lymphocytes", "Single Cells", "Live", "CD45+", "T cells", "Subset"]
+CONDITIONS = ["Ctl", "Stim", "Inhib", "Vehicle"]
+
+
+def marker_columns(n_markers, gate_depth=2):
+    """Marker column names with gate_depth '/' separated gate prefixes"""
+    prefix = "/".join(GATE_PATH[:gate_depth])
+    cols = []
+    for i in range(n_markers):
+        stat = "Freq. of Parent" if i % 3 else "Median"
+        name = f"M{i:03d}" if not prefix else f"{prefix}/M{i:03d}"
+        cols.append(f"{name} | {stat}")
+    return cols
+
+
+def generate_flowjo_frame(n_rows, n_markers, gate_depth=2, n_donors=8, seed=0):
+    """
+    Build a synthetic export as a DataFrame.
+
+    Identifiers look like "D03_Stim_0042.fcs" so they can be split on "_"
+    into Donor, Condition and Replicate.
+    """
+    rng = np.random.default_rng(seed)
+    donors = rng.integers(0, n_donors, n_rows)
+    conditions = rng.integers(0, len(CONDITIONS), n_rows)
+    ids = [f"D{d:02d}_{CONDITIONS[c]}_{i:05d}.fcs" for i, (d, c) in enumerate(zip(donors, conditions))]
+
+    data = {"Sample:": ids}
+    for col in marker_columns(n_markers, gate_depth):
+        data[col] = np.round(rng.gamma(2.0, 10.0, n_rows), 3)
+    df = pd.DataFrame(data)
+
+    # FlowJo footer rows
+    markers = df.columns[1:]
+    footer = pd.DataFrame([
+        ["Mean"] + df[markers].mean().round(3).tolist(),
+        ["SD"] + df[markers].std().round(3).tolist(),
+    ], columns=df.columns)
+    return pd.concat([df, footer], ignore_index=True)
+
+
+def write_flowjo_csv(path, n_rows, n_markers, gate_depth=2, n_donors=8, seed=0):
+    """Write a synthetic export to path (a file name or a text buffer)"""
+    generate_flowjo_frame(n_rows, n_markers, gate_depth, n_donors, seed).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic FlowJo table export")
+    parser.add_argument("output", help="CSV file to write")
+    parser.add_argument("--rows", type=int, default=1000, help="events / samples")
+    parser.add_argument("--markers", type=int, default=20, help="marker columns")
+    parser.add_argument("--gate-depth", type=int, default=2, help="gate prefixes before each marker")
+    parser.add_argument("--donors", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_flowjo_csv(args.output, args.rows, args.markers, args.gate_depth, args.donors, args.seed)
+
+
+if __name__ == "__main__":
+    main()
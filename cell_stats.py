@@ -0,0 +1,176 @@
+"""
+Plotted cells and their statistics
+
+Pure functions on melted frames and their per-cell summaries, shared by the
+web app, the render workers and the headless CLI: the columns that split a
+plot into cells, melt summaries, pooled cell statistics, the figure
+layout and palette colors. Nothing here touches Flask or the database.
+"""
+import config
+
+# Columns of a melt summary that are statistics, the others are its cell keys
+SUMMARY_STATS = ("n", "mean", "sd", "sem", "q1", "median", "q3", "whisker_low", "whisker_high")
+
+
+def plot_keys(spec):
+    """Distinct columns that split the data into plotted cells: x, fill group and facets"""
+    keys = []
+    for col in (spec["xaxis"], spec["group"], spec["frows"], spec["fcols"]):
+        if col and col != "." and col not in keys:
+            keys.append(col)
+    return keys
+
+
+def discrete_levels(values):
+    """
+    Levels of a fill or facet column in the order plotnine's discrete scales
+    use: the category order of a categorical, else sorted.
+    """
+    import pandas as pd
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        present = set(values.dropna().unique())
+        return [level for level in values.cat.categories if level in present]
+    return sorted(values.dropna().unique())
+
+
+def figure_layout(df, x_col, row_var, col_var, group, n_groups,
+                  base_width_per_tick=config.PLOT_BASE_WIDTH_PER_TICK,
+                  min_panel_width=config.PLOT_MIN_PANEL_WIDTH):
+    """
+    Panel width in inches, facet rows and columns, and whether a legend is drawn.
+
+    The panel width includes the legend's share when there is one.
+    """
+    # Number of X-axis ticks per panel
+    if "Vars" in [x_col, row_var, col_var]:
+        n_ticks = df[x_col].nunique()
+    else: 
+        n_ticks = df[x_col].nunique() +  df['Vars'].nunique()
+
+    panel_width = max(min_panel_width, n_ticks * base_width_per_tick)
+
+    legend = group not in [x_col, row_var, col_var]
+    if legend:
+        panel_width = panel_width + 4 + (n_groups * 0.3)
+
+    if row_var and row_var != "." and row_var in df.columns:
+        nrow = df[row_var].nunique()
+    else:
+        nrow = 1
+
+    if col_var and col_var != "." and col_var in df.columns:
+        ncol = df[col_var].nunique()
+    else:
+        ncol = 1
+
+    return panel_width, nrow, ncol, legend
+
+
+def get_discrete_cmap_colors(n_colors, cmap):
+    """
+    Get n discrete colors from a matplotlib colormap
+    
+    Args:
+        n_colors: number of colors needed
+        cmap: colormap name ('Accent', 'Accent_r', 'Blues', 'Blues_r', 'BrBG', 'BrBG_r',
+            'BuGn', 'BuGn_r', 'BuPu', 'BuPu_r', 'CMRmap', 'CMRmap_r', 'Dark2', 'Dark2_r', 
+            'GnBu', 'GnBu_r', 'Grays', 'Greens', 'Greens_r', 'Greys', 'Greys_r', 'OrRd', 
+            'OrRd_r', 'Oranges', 'Oranges_r', 'PRGn', 'PRGn_r', 'Paired', 'Paired_r', 
+            'Pastel1', 'Pastel1_r', 'Pastel2', 'Pastel2_r', 'PiYG', 'PiYG_r', 'PuBu', 
+            'PuBuGn', 'PuBuGn_r', 'PuBu_r', 'PuOr', 'PuOr_r', 'PuRd', 'PuRd_r', 'Purples',
+            'Purples_r', 'RdBu', 'RdBu_r', 'RdGy', 'RdGy_r', 'RdPu', 'RdPu_r', 'RdYlBu', 
+            'RdYlBu_r', 'RdYlGn', 'RdYlGn_r', 'Reds', 'Reds_r', 'Set1', 'Set1_r', 'Set2',
+            'Set2_r', 'Set3', 'Set3_r', 'Spectral', 'Spectral_r', 'Wistia', 'Wistia_r', 
+            'YlGn', 'YlGnBu', 'YlGnBu_r', 'YlGn_r', 'YlOrBr', 'YlOrBr_r', 'YlOrRd', 
+            'YlOrRd_r', 'afmhot', 'afmhot_r', 'autumn', 'autumn_r', 'binary', 'binary_r', 
+            'bone', 'bone_r', 'brg', 'brg_r', 'bwr', 'bwr_r', 'cividis', 'cividis_r', 
+            'cool', 'cool_r', 'coolwarm', 'coolwarm_r', 'copper', 'copper_r', 'cubehelix', 
+            'cubehelix_r', 'flag', 'flag_r', 'gist_earth', 'gist_earth_r', 'gist_gray', 
+            'gist_gray_r', 'gist_grey', 'gist_heat', 'gist_heat_r', 'gist_ncar', 'gist_ncar_r', 
+            'gist_rainbow', 'gist_rainbow_r', 'gist_stern', 'gist_stern_r', 'gist_yarg', 'gist_yarg_r', 
+            'gist_yerg', 'gnuplot', 'gnuplot2', 'gnuplot2_r', 'gnuplot_r', 'gray', 'gray_r', 'grey', 
+            'hot', 'hot_r', 'hsv', 'hsv_r', 'inferno', 'inferno_r', 'jet', 'jet_r', 'magma', 'magma_r', 
+            'nipy_spectral', 'nipy_spectral_r', 'ocean', 'ocean_r', 'pink', 'pink_r', 'plasma', 
+            'plasma_r', 'prism', 'prism_r', 'rainbow', 'rainbow_r', 'seismic', 'seismic_r', 'spring', 
+            'spring_r', 'summer', 'summer_r', 'tab10', 'tab10_r', 'tab20', 'tab20_r', 'tab20b', 'tab20b_r', 
+            'tab20c', 'tab20c_r', 'terrain', 'terrain_r', 'turbo', 'turbo_r', 'twilight', 'twilight_r', 
+            'twilight_shifted', 'twilight_shifted_r', 'viridis', 'viridis_r', 'winter', 'winter_r')
+    
+    Returns:
+        list of hex color codes
+    """
+    # Not plotnine, the web app colors browser plots with it
+    import matplotlib.cm as cm
+    import matplotlib.colors as mcolors
+
+    colormap = cm.get_cmap(cmap)
+    # Sample colors evenly across the colormap
+    colors = [mcolors.rgb2hex(colormap(i / (n_colors - 1 if n_colors > 1 else 1))) 
+              for i in range(n_colors)]
+    
+    return colors
+
+
+def summarize_melt(mdf):
+    """
+    Statistics of every (categorical..., Vars) cell of a melted frame.
+
+    One grouped pass gives n, mean, sd, sem, quartiles and the boxplot whisker
+    ends, the most extreme values within 1.5 IQR of the box. Cells are in
+    order of first appearance, so the summary also gives every column's
+    levels, in plot order, and cardinality without touching the rows again.
+    """
+    import pandas as pd
+
+    keys = [c for c in mdf.columns if c != "value"]
+    ids = mdf.groupby(keys, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    value = pd.to_numeric(mdf["value"], errors="coerce")
+    by_cell = value.groupby(ids)
+
+    summary = mdf[keys].groupby(ids).first()
+    summary = summary.join(by_cell.agg(n="count", mean="mean", sd="std"))
+    summary["sd"] = summary["sd"].fillna(0)
+    summary["sem"] = summary["sd"] / summary["n"].where(summary["n"] > 0) ** 0.5
+    quartiles = by_cell.quantile([0.25, 0.5, 0.75]).unstack()
+    quartiles.columns = ["q1", "median", "q3"]
+    summary = summary.join(quartiles)
+
+    # Whiskers: the fences are per cell, broadcast back to the rows by cell id
+    iqr = summary["q3"] - summary["q1"]
+    low_fence = (summary["q1"] - 1.5 * iqr).to_numpy()[ids]
+    high_fence = (summary["q3"] + 1.5 * iqr).to_numpy()[ids]
+    inside = value.where((value >= low_fence) & (value <= high_fence)).groupby(ids)
+    summary["whisker_low"] = inside.min()
+    summary["whisker_high"] = inside.max()
+    return summary.reset_index(drop=True)
+
+
+def summary_cells(summary, keys, stat):
+    """
+    Statistics per plotted cell from the melt summary, or None if the rows are needed.
+
+    stat is the bar statistic, "mean" or "median", or "box" for boxplots.
+    Cells split by every summary key are summary rows as they are. Coarser
+    cells pool the count, mean and sd of their summary rows, medians and
+    quartiles cannot be pooled and need the rows.
+    """
+    summary_keys = [c for c in summary.columns if c not in SUMMARY_STATS]
+    if set(keys) == set(summary_keys):
+        return summary
+    if stat != "mean":
+        return None
+
+    # Pooled mean and variance from each cell's n, mean and sd
+    parts = summary[keys].copy()
+    n = summary["n"]
+    parts["n"] = n
+    parts["total"] = (n * summary["mean"]).fillna(0)
+    parts["squares"] = ((n - 1).clip(lower=0) * summary["sd"] ** 2 + n * summary["mean"] ** 2).fillna(0)
+    cells = parts.groupby(keys, sort=False, dropna=False)[["n", "total", "squares"]].sum().reset_index()
+    count = cells["n"].where(cells["n"] > 0)
+    cells["mean"] = cells["total"] / count
+    variance = (cells["squares"] - count * cells["mean"] ** 2) / (count - 1).where(count > 1)
+    cells["sd"] = (variance.clip(lower=0) ** 0.5).fillna(0)
+    cells["sem"] = cells["sd"] / count ** 0.5
+    return cells.drop(columns=["total", "squares"])
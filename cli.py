@@ -0,0 +1,200 @@
+"""
+Headless batch pipeline
+
+Runs a directory of FlowJo CSV exports through the same steps as /upload,
+/process_columns and /graph, entirely in memory: ID cleanup and splitting,
+FlowJo Mean/SD and prefix removal, melt, then one plot per file. Files are
+processed in parallel on a process pool, progress is printed as each file
+finishes and failures are summarized at the end.
+
+    python cli.py exports/ --output plots/ --split-ids "Donor, Treat, Rep" \
+        --flowjo --prefix-remove 1 --categorical Donor Treat --group Treat
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def process_file(path, name, options):
+    """
+    Clean, melt and plot one export to name, relative to the output directory.
+
+    Returns (path, output path or None, error or None, seconds).
+    """
+    import pandas as pd
+    import metrics
+    from preprocess import UploadPlan
+    from plotting import render_graph
+
+    start = time.perf_counter()
+    try:
+        dat = pd.read_csv(path, encoding="utf-8")
+        if len(dat.columns) < 2:
+            raise ValueError("File must have at least 2 columns")
+        plan = UploadPlan(dat.columns, split_cols=options["split_cols"], split_symbol=options["separator"],
+                          flowjo=options["flowjo"], prefix_number=options["prefix_remove"])
+        dat = plan.apply(dat)
+        plan.finish()
+
+        categorical = options["categorical"]
+        missing = [c for c in categorical + (options["continuous"] or []) if c not in dat.columns]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(missing)}")
+        # Every numeric column is a marker unless they were listed
+        continuous = options["continuous"] or [
+            c for c in dat.select_dtypes("number").columns if c not in categorical
+        ]
+        mdf = dat[categorical + continuous].melt(id_vars=categorical, var_name="Vars")
+
+        fig = render_graph(mdf, options["spec"], format=options["format"], dpi=options["dpi"])
+        out_path = os.path.join(options["output"], f"{name}.{options['format']}")
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb" if isinstance(fig, bytes) else "w") as f:
+            f.write(fig)
+        return path, out_path, None, time.perf_counter() - start
+    except Exception as e:
+        if options["verbose"]:
+            traceback.print_exc()
+        return path, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    finally:
+        # Nobody collects the stage timings of a CLI run
+        metrics.drain_stages()
+
+
+def _warm_worker():
+    import plotting
+    plotting.warm_up()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plot a directory of FlowJo CSV exports without the web UI")
+    parser.add_argument("inputs", nargs="+", help="CSV files or directories of CSV files")
+    parser.add_argument("--output", "-o", default="plots", help="directory for the rendered plots")
+    parser.add_argument("--recursive", action="store_true", help="search directories recursively")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--verbose", action="store_true", help="print tracebacks of failed files")
+
+    cleanup = parser.add_argument_group("upload options")
+    cleanup.add_argument("--split-ids", help='new ID column names, comma separated, e.g. "Donor, Treat, Rep"')
+    cleanup.add_argument("--separator", default="_", help="symbol the IDs are split on")
+    cleanup.add_argument("--flowjo", action="store_true", help="remove FlowJo Mean/SD rows and 'Freq. of '")
+    cleanup.add_argument("--prefix-remove", type=int, default=0, help="gate prefixes to remove from column names")
+
+    columns = parser.add_argument_group("column options")
+    columns.add_argument("--categorical", nargs="+", required=True, help="categorical columns kept as IDs")
+    columns.add_argument("--continuous", nargs="+", help="marker columns to plot, default every numeric column")
+
+    plot = parser.add_argument_group("plot options")
+    plot.add_argument("--x", default="Vars", help="X axis column")
+    plot.add_argument("--group", default="Vars", help="fill group column")
+    plot.add_argument("--row-facet", default=".", help="row facet column")
+    plot.add_argument("--col-facet", default=".", help="column facet column")
+    plot.add_argument("--palette", default="GnBu", help="matplotlib colormap")
+    plot.add_argument("--graph-type", choices=["Boxplot", "Bar"], default="Boxplot")
+    plot.add_argument("--bar-stat", choices=["mean", "median"], default="mean")
+    plot.add_argument("--error-bars", choices=["none", "sd", "sem"], default="none")
+    plot.add_argument("--format", choices=["svg", "pdf", "png"], default="svg")
+    plot.add_argument("--dpi", type=int, default=None, help="raster resolution, default DOWNLOAD_DEFAULT_DPI")
+    return parser.parse_args(argv)
+
+
+def find_inputs(inputs, recursive=False):
+    """
+    List (path, output name) of the CSV files to plot.
+
+    A file found in a directory keeps its path relative to that directory
+    as its output name, so in/a.csv and in/sub/a.csv are plotted to
+    out/a.svg and out/sub/a.svg.
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.csv") if recursive else os.path.join(item, "*.csv")
+            for path in sorted(glob.glob(pattern, recursive=recursive)):
+                found.append((path, os.path.splitext(os.path.relpath(path, item))[0]))
+        else:
+            found.append((item, os.path.splitext(os.path.basename(item))[0]))
+    return found
+
+
+def unique_names(found):
+    """
+    Suffix output names that are still taken, e.g. by the same file name in
+    two input directories. Returns the inputs and the (path, name) renamed.
+    """
+    taken = set()
+    unique, renamed = [], []
+    for path, name in found:
+        candidate, n = name, 2
+        while os.path.normcase(candidate) in taken:
+            candidate, n = f"{name}_{n}", n + 1
+        taken.add(os.path.normcase(candidate))
+        unique.append((path, candidate))
+        if candidate != name:
+            renamed.append((path, candidate))
+    return unique, renamed
+
+
+def main(argv=None):
+    import config
+
+    args = parse_args(argv)
+    inputs, renamed = unique_names(find_inputs(args.inputs, args.recursive))
+    if not inputs:
+        print("No CSV files found", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    split_cols = [x.strip() for x in args.split_ids.split(",") if x.strip()] if args.split_ids else None
+    options = {
+        "split_cols": split_cols,
+        "separator": args.separator,
+        "flowjo": args.flowjo,
+        "prefix_remove": args.prefix_remove,
+        "categorical": args.categorical,
+        "continuous": args.continuous,
+        "spec": {
+            "xaxis": args.x,
+            "frows": args.row_facet,
+            "fcols": args.col_facet,
+            "group": args.group,
+            "palette": args.palette,
+            "graph_type": args.graph_type,
+            "bar_stat": args.bar_stat,
+            "error_bars": args.error_bars,
+        },
+        "format": args.format,
+        "dpi": args.dpi or config.DOWNLOAD_DEFAULT_DPI,
+        "output": args.output,
+        "verbose": args.verbose,
+    }
+
+    started = time.perf_counter()
+    failures = []
+    jobs = max(1, min(args.jobs or 1, len(inputs)))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_warm_worker) as executor:
+        futures = [executor.submit(process_file, path, name, options) for path, name in inputs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            path, out_path, error, seconds = future.result()
+            status = f"-> {out_path}" if error is None else f"FAILED {error}"
+            print(f"[{done}/{len(inputs)}] {path} {status} ({seconds:.1f}s)", file=sys.stderr)
+            if error is not None:
+                failures.append((path, error))
+
+    print(f"\n{len(inputs) - len(failures)} of {len(inputs)} files plotted in "
+          f"{time.perf_counter() - started:.1f}s, {len(failures)} failed", file=sys.stderr)
+    for path, error in failures:
+        print(f"  {path}: {error}", file=sys.stderr)
+    if renamed:
+        print(f"{len(renamed)} plots renamed, their names were taken:", file=sys.stderr)
+        for path, name in renamed:
+            print(f"  {path} -> {name}.{args.format}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
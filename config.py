@@ -4,24 +4,169 @@ Application Configuration
 try:
     from secretsconfig import SECRET_KEY, DATABASE_PATH
 except ImportError:
-    raise ImportError(
-        "secretsconfig.py not found! Rename secrets.example.py to secretsconfig.py and configure it."
-    )
+    # The headless CLI plots without sessions or a database, the web app
+    # refuses to start without them (see app.py)
+    SECRET_KEY = DATABASE_PATH = None
 
 # =============================================================================
 # SESSION CLEANUP INTERVAL (hours)
 # =============================================================================
 CLEANUP_INTERVAL = 2
+# Age after which the expiry scheduler drops a session table
+TABLE_TTL_HOURS = CLEANUP_INTERVAL
+# Minutes between expiry sweeps
+CLEANUP_SWEEP_MINUTES = 10
+# Tables dropped per sweep transaction
+CLEANUP_BATCH_SIZE = 20
   
+# =============================================================================
+# SQLITE CONNECTION SETTINGS
+# =============================================================================
+# NORMAL is durable in WAL mode except for the last commits on power loss
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+SQLITE_MMAP_SIZE_MB = 256
+# Seconds a writer waits for the lock before "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+# Small database the web workers share render admissions and jobs through,
+# kept off the session store's write lock. None: DATABASE_PATH + ".coord"
+COORDINATION_DATABASE_PATH = None
+
 # =============================================================================
 # FILE UPLOAD SETTINGS
 # =============================================================================
-MAX_FILE_SIZE_MB = 10
+MAX_FILE_SIZE_MB = 250
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# Rows parsed per chunk while streaming an upload into the database
+UPLOAD_CHUNK_ROWS = 50000
 
 # =============================================================================
 # PLOT DEFAULTS
 # =============================================================================
 PLOT_BASE_WIDTH_PER_TICK = 1
 PLOT_MIN_PANEL_WIDTH = 2.0
-PLOT_PANEL_HEIGHT = 5.0
\ No newline at end of file
+PLOT_PANEL_HEIGHT = 5.0
+# Resolution of rasterized layers embedded in the SVG
+PLOT_RASTER_DPI = 150
+# Upper bound on the pixels of an embedded raster layer, dpi is lowered to fit
+PLOT_MAX_RASTER_PIXELS = 8_000_000
+
+# =============================================================================
+# LARGE DATA BOXPLOTS
+# =============================================================================
+# Rows above which the jitter layer of a boxplot is reduced
+BOXPLOT_LARGE_N_THRESHOLD = 5000
+# "downsample": plot at most BOXPLOT_JITTER_CAP_PER_CELL points per cell
+# "raster":     plot every point, as one bitmap inside the SVG
+BOXPLOT_LARGE_N_MODE = "downsample"
+BOXPLOT_JITTER_CAP_PER_CELL = 300
+
+# =============================================================================
+# BROWSER RENDERING
+# =============================================================================
+# Jitter points per cell sent by /plot_data for drawing boxplots client side
+CLIENT_POINTS_PER_CELL = 300
+# Most fill colors /plot_colors returns at once
+CLIENT_MAX_COLORS = 1000
+
+# =============================================================================
+# RENDER CACHE
+# =============================================================================
+RENDER_CACHE_MAX_MB = 64
+
+# =============================================================================
+# DATAFRAME CACHE
+# =============================================================================
+# Memory budget of the per-process cache of session tables loaded into pandas
+FRAME_CACHE_MAX_MB = 256
+
+# =============================================================================
+# MELTED DATA STORAGE
+# =============================================================================
+# "view":  long format is a UNION ALL view over the uploaded table (no copy)
+# "table": long format is melted in pandas and written as its own table
+# "compact": like "table", with label columns stored as integer codes into a
+#            per-session dictionary table and loaded as pandas categories
+# A changed marker selection only melts or summarizes the added markers. In
+# "table" and "compact" mode that needs the kept markers in their old order
+# with new ones at the end, other changes melt everything again
+MELT_MODE = "view"
+# Compact mode only: round values to float32 and load them as float32
+MELT_VALUE_FLOAT32 = False
+
+# =============================================================================
+# DATA PREVIEW
+# =============================================================================
+# Rows per page served by /preview_data
+PREVIEW_PAGE_SIZE = 100
+PREVIEW_MAX_PAGE_SIZE = 1000
+
+# =============================================================================
+# RENDER WORKER POOL
+# =============================================================================
+# Render plots in pre-warmed worker processes instead of the request thread
+RENDER_POOL_ENABLED = True
+RENDER_WORKERS = 2
+# Seconds a single render may take before its worker is killed
+RENDER_TIMEOUT_SECONDS = 60
+# Seconds a request waits for a free worker
+RENDER_QUEUE_TIMEOUT_SECONDS = 30
+# Address space cap per worker process (Unix only), 0 disables it
+RENDER_WORKER_MEMORY_MB = 2048
+# Replace a worker after this many renders
+RENDER_WORKER_MAX_JOBS = 50
+# Seconds a finished async render job is kept for /graph/status
+RENDER_JOB_TTL_SECONDS = 600
+
+# =============================================================================
+# RENDER LIMITS
+# =============================================================================
+# Checked against an estimate before a plot is rendered
+RENDER_MAX_PANELS = 60
+# Largest figure side, facet grids and x axes with many values grow without bound
+RENDER_MAX_FIGURE_INCHES = 150
+# Jitter points in one boxplot: above it the points are downsampled, or the
+# plot refused when RENDER_AUTO_DEGRADE is False
+RENDER_MAX_POINTS = 100_000
+RENDER_AUTO_DEGRADE = True
+# Pixels of a PNG export or of the rasterized layers of a PDF, the dpi is lowered to fit
+RENDER_MAX_PIXELS = 50_000_000
+# Renders one session may have running or queued, in all web worker processes
+RENDER_MAX_PER_SESSION = 2
+# Estimated cost of all renders in flight in all web worker processes, in
+# jitter point equivalents (see admission.py), further renders queue for
+# RENDER_QUEUE_TIMEOUT_SECONDS
+RENDER_BUDGET = 400_000
+
+# =============================================================================
+# PLOT DOWNLOADS
+# =============================================================================
+DOWNLOAD_DEFAULT_DPI = 300
+DOWNLOAD_MAX_DPI = 600
+
+# =============================================================================
+# PLOT FILTERS
+# =============================================================================
+# Columns with more labels than this get no filter list on the graph form
+FILTER_MAX_LEVELS = 200
+
+# =============================================================================
+# BATCH PLOTS
+# =============================================================================
+# Most plots a single /graph/batch request may render
+BATCH_MAX_PLOTS = 100
+
+# =============================================================================
+# STARTUP
+# =============================================================================
+# pandas, matplotlib and plotnine are imported on first use. Set True to import
+# them and render a dummy plot at startup (in the render workers when the pool
+# is enabled) so the first graph request is not slowed down
+PRELOAD_PLOTTING = False
+
+# =============================================================================
+# PROFILING
+# =============================================================================
+# Allow ?profile=1 to write a cProfile dump of that request to PROFILE_DIR
+PROFILING_ENABLED = False
+PROFILE_DIR = "profiles"
@@ -0,0 +1,120 @@
+"""
+SQLite connection management
+
+Every thread reuses one connection to the session store, opened in WAL mode
+with the pragmas from config. transaction() groups several statements, e.g. a
+new table and its table_lifetime row, into one atomic commit. A connection
+is closed when its thread ends and the thread-local holding it goes away.
+
+Render admissions and async render jobs live in a separate, small
+coordination database (get_coordination()) written with single autocommit
+statements, so they never wait behind an upload or melt holding the session
+store's write lock.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+import config
+from metrics import stage
+
+_local = threading.local()
+
+
+def _configure(conn):
+    # WAL lets readers continue while an upload is being written
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    # Negative cache_size is in KiB
+    conn.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def get_connection():
+    """Return this thread's connection, opening it on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # isolation_level=None: no implicit transactions, transaction() decides
+        conn = sqlite3.connect(config.DATABASE_PATH,
+                               timeout=config.SQLITE_BUSY_TIMEOUT_SECONDS,
+                               isolation_level=None)
+        _configure(conn)
+        _local.conn = conn
+    return conn
+
+
+# Tables of the coordination database, shared by every web worker process
+COORDINATION_SCHEMA = [
+    # Renders queued or running, see admission.py
+    """CREATE TABLE IF NOT EXISTS render_admissions (
+        id TEXT PRIMARY KEY,
+        owner TEXT,
+        cost INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        started REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS render_admissions_owner ON render_admissions (owner)",
+    # Async render jobs, see render_jobs.py
+    """CREATE TABLE IF NOT EXISTS render_jobs (
+        id TEXT PRIMARY KEY,
+        key TEXT NOT NULL,
+        owner TEXT,
+        spec TEXT,
+        status TEXT NOT NULL,
+        error TEXT,
+        created REAL NOT NULL,
+        finished_at REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS render_jobs_key ON render_jobs (key)",
+]
+
+
+def coordination_path():
+    """The coordination database file, next to the session store unless configured"""
+    return config.COORDINATION_DATABASE_PATH or f"{config.DATABASE_PATH}.coord"
+
+
+def get_coordination():
+    """
+    Return this thread's connection to the coordination database.
+
+    Its rows are short-lived and rebuilt by the running processes, so it is
+    not synced to disk. Every write is a single statement, checks and
+    updates that must be atomic are one INSERT ... SELECT or UPDATE ... WHERE.
+    """
+    conn = getattr(_local, "coord", None)
+    if conn is None:
+        conn = sqlite3.connect(coordination_path(),
+                               timeout=config.SQLITE_BUSY_TIMEOUT_SECONDS,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        for statement in COORDINATION_SCHEMA:
+            conn.execute(statement)
+        _local.coord = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements as one write transaction.
+
+    The write lock is taken up front (BEGIN IMMEDIATE) so concurrent writers
+    queue on busy_timeout instead of failing halfway. A transaction opened
+    inside another one on the same thread joins the outer transaction.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    # Waiting for another writer's lock shows up as its own stage
+    with stage("db_lock_wait"):
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
@@ -0,0 +1,125 @@
+"""
+Background expiry of session tables
+
+A daemon thread sweeps table_lifetime every CLEANUP_SWEEP_MINUTES, drops tables
+older than TABLE_TTL_HOURS in batches of CLEANUP_BATCH_SIZE and hands the freed
+pages back to the file system with an incremental vacuum. A table shared by
+de-duplicated uploads has its Created time reset whenever another session picks
+it up, so it expires TABLE_TTL_HOURS after its last reference.
+"""
+import threading
+import time
+from datetime import timezone, datetime
+import config
+from db import get_connection, transaction
+from helpers import drop_relation, invalidate_table_caches
+from metrics import cleanup_seconds, drain_stages
+
+# Totals since start and the result of the most recent sweep
+sweep_stats = {
+    "sweeps": 0,
+    "tables_dropped": 0,
+    "bytes_reclaimed": 0,
+    "last_sweep": None,
+}
+_stats_lock = threading.Lock()
+_scheduler = None
+_stop = threading.Event()
+
+
+def database_size(conn):
+    """Size of the database file in bytes, from the page count"""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def sweep_expired_tables(ttl_hours=None, batch_size=None):
+    """
+    Drop every expired session table and reclaim the space it used.
+
+    Each batch is its own short write transaction so uploads are not held up
+    behind a large sweep. Returns the stats of this sweep.
+    """
+    ttl_hours = config.TABLE_TTL_HOURS if ttl_hours is None else ttl_hours
+    batch_size = config.CLEANUP_BATCH_SIZE if batch_size is None else batch_size
+    started = time.monotonic()
+    conn = get_connection()
+    size_before = database_size(conn)
+
+    dropped = 0
+    while True:
+        with transaction() as conn:
+            # Get the next batch of expired table IDs
+            expired_ids = [row[0] for row in conn.execute("""
+                SELECT id
+                FROM table_lifetime
+                WHERE julianday(Created) < julianday('now', ?)
+                LIMIT ?
+            """, (f"-{ttl_hours} hours", batch_size))]
+
+            for table_id in expired_ids:
+                drop_relation(conn, table_id)
+
+            # Remove from tracking table
+            conn.executemany(
+                "DELETE FROM table_lifetime WHERE id = ?",
+                [(table_id,) for table_id in expired_ids]
+            )
+
+        for table_id in expired_ids:
+            invalidate_table_caches(table_id)
+        dropped += len(expired_ids)
+        if len(expired_ids) < batch_size:
+            break
+
+    # Return freed pages to the file system. The pragma frees one page per
+    # step and execute() only steps it once, executescript() runs it until
+    # the freelist is empty
+    if dropped:
+        conn.executescript("PRAGMA incremental_vacuum;")
+    reclaimed = max(0, size_before - database_size(conn))
+
+    cleanup_seconds.observe("sweep", time.monotonic() - started)
+    stats = {
+        "tables": dropped,
+        "bytes_reclaimed": reclaimed,
+        "duration_seconds": round(time.monotonic() - started, 4),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with _stats_lock:
+        sweep_stats["sweeps"] += 1
+        sweep_stats["tables_dropped"] += dropped
+        sweep_stats["bytes_reclaimed"] += reclaimed
+        sweep_stats["last_sweep"] = stats
+
+    if dropped:
+        print(f"Cleaned up {dropped} expired tables, reclaimed {reclaimed} bytes")
+    return stats
+
+
+def _run_scheduler(interval_seconds):
+    while not _stop.is_set():
+        try:
+            sweep_expired_tables()
+        except Exception as e:
+            print(f"Cleanup error: {e}")
+        # The sweep's stage timings only feed the histograms
+        drain_stages()
+        _stop.wait(interval_seconds)
+
+
+def start_expiry_scheduler():
+    """Start the sweep thread once per process"""
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    _stop.clear()
+    _scheduler = threading.Thread(target=_run_scheduler,
+                                  args=(config.CLEANUP_SWEEP_MINUTES * 60,),
+                                  name="table-expiry", daemon=True)
+    _scheduler.start()
+
+
+def stop_expiry_scheduler():
+    _stop.set()
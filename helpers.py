@@ -1,26 +1,174 @@
 import sqlite3
-from io import StringIO
-import re
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import timezone, datetime
-from plotnine import theme
-import textwrap
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
 import config
+from db import get_connection, transaction
+from metrics import stage, rows_processed
 from flask import session
+from cell_stats import summarize_melt
 
 DB_PATH = config.DATABASE_PATH
 
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by a total byte budget.
+
+    Every entry is tagged with the session table it was computed from so that
+    dropping the table can evict everything derived from it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (value, size, table)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, table=None):
+        # Entries larger than the whole budget are never stored
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size, table)
+            self.current_bytes += size
+            # Evict least recently used entries until within budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+
+    def invalidate_table(self, table):
+        if not table:
+            return
+        with self._lock:
+            stale = [k for k, (_, _, t) in self._entries.items() if t == table]
+            for key in stale:
+                _, size, _ = self._entries.pop(key)
+                self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Rendered SVG strings, keyed by render_cache_key()
+render_cache = LRUCache(config.RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+# Session tables and melt summaries loaded into pandas, keyed by cached_frame().
+# Tables never change under a name (a re-melt renames), so entries only leave
+# by LRU eviction or invalidate_table_caches()
+frame_cache = LRUCache(config.FRAME_CACHE_MAX_MB * 1024 * 1024)
+_frame_locks = {}
+_frame_locks_guard = threading.Lock()
+
+
+def invalidate_table_caches(table_name):
+    """Forget the renders and loaded frames of a dropped or replaced table"""
+    render_cache.invalidate_table(table_name)
+    frame_cache.invalidate_table(table_name)
+
+
+def frame_cache_key(table_name, kind, filters=None, columns=None):
+    return (table_name, kind, repr(sorted((filters or {}).items())), None if columns is None else tuple(columns))
+
+
+def cached_frame(table_name, kind, load, filters=None, columns=None):
+    """
+    Return the DataFrame load() reads for table_name through frame_cache.
+
+    kind tells apart what is read ("rows", "summary"), filters and the
+    columns read (None for all) are part of the key. Concurrent misses for the same key wait for the first load
+    instead of reading the table again. Cached frames are shared, callers
+    must not modify them in place. A None result is not cached.
+    """
+    key = frame_cache_key(table_name, kind, filters, columns)
+    frame = frame_cache.get(key)
+    if frame is not None:
+        return frame
+
+    with _frame_locks_guard:
+        lock = _frame_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            frame = frame_cache.get(key)
+            if frame is None:
+                frame = load()
+                if frame is not None:
+                    frame_cache.put(key, frame, int(frame.memory_usage(deep=True).sum()), table=table_name)
+    finally:
+        with _frame_locks_guard:
+            if _frame_locks.get(key) is lock and not lock.locked():
+                del _frame_locks[key]
+    return frame
+
+
+def render_cache_key(filtered_table, spec):
+    """Content address of a render: the data table, every plot option and the size config"""
+    parts = (
+        filtered_table, sorted(spec.items()),
+        config.PLOT_BASE_WIDTH_PER_TICK, config.PLOT_MIN_PANEL_WIDTH, config.PLOT_PANEL_HEIGHT,
+    )
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
 def init_db():
     ## Initialize database table
     try:
-        with sqlite3.connect(config.DATABASE_PATH) as conn:
+        # Freed pages can only be handed back with auto_vacuum=INCREMENTAL,
+        # switching an existing database over needs one full VACUUM
+        conn = get_connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+        with transaction() as conn:
+            # content_hash identifies an upload for de-duplication, refs counts
+            # the sessions sharing the table
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS table_lifetime (
                     id TEXT PRIMARY KEY,
-                    Created TEXT NOT NULL
+                    Created TEXT NOT NULL,
+                    content_hash TEXT,
+                    refs INTEGER NOT NULL DEFAULT 1
                 )
             """)
+            # Databases created before de-duplication
+            columns = table_columns(conn, "table_lifetime")
+            if "content_hash" not in columns:
+                conn.execute("ALTER TABLE table_lifetime ADD COLUMN content_hash TEXT")
+            if "refs" not in columns:
+                conn.execute("ALTER TABLE table_lifetime ADD COLUMN refs INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS table_lifetime_hash ON table_lifetime (content_hash)")
     except sqlite3.Error as e:
         return print(f"Database error: {str(e)}")
     
@@ -30,119 +178,474 @@ def check_session_tables():
         return False
     return True
 
-def drop_table(table_name):
-    if not table_name:
-        return
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            # Delete table
-            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-                    
-            # Remove from tracking table
-            conn.execute(f"DELETE FROM table_lifetime WHERE id = ?", (table_name,))
-
-            conn.commit()
-    except Exception as e:
-        return str(e)
+def quote_ident(name):
+    """Quote a column or table name for use in generated SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
 
-def wrap_labels(text, width=20):
-    return [textwrap.fill(label, width=width) for label in text]
+def quote_literal(value):
+    """Quote a string constant for use in generated SQL"""
+    return "'" + str(value).replace("'", "''") + "'"
 
-def plotnine_to_svgString_dynasize(p, df, x_col, row_var, col_var, group, n_groups,
-                             base_width_per_tick = config.PLOT_BASE_WIDTH_PER_TICK,
-                             min_panel_width = config.PLOT_MIN_PANEL_WIDTH,
-                             min_panel_height = config.PLOT_PANEL_HEIGHT):
-    
-    
-    # Number of X-axis ticks per panel
-    if "Vars" in [x_col, row_var, col_var]:
-        n_ticks = df[x_col].nunique()
-    else: 
-        n_ticks = df[x_col].nunique() +  df['Vars'].nunique()
+def drop_relation(conn, name):
+    """Drop a session table or view, whichever name refers to, and its companion tables"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    kind = "VIEW" if row and row[0] == "view" else "TABLE"
+    conn.execute(f"DROP {kind} IF EXISTS {name}")
+    # Dictionary of a compact melted table and per-cell summary of a melt
+    conn.execute(f"DROP TABLE IF EXISTS {name}_dict")
+    conn.execute(f"DROP TABLE IF EXISTS {name}_summary")
 
-    panel_width = max(min_panel_width, n_ticks * base_width_per_tick)
+def melt_format(conn, table_name):
+    """How a melted table is stored: "view", "compact", "table" or None if it is gone"""
+    kinds = dict(conn.execute(
+        "SELECT name, type FROM sqlite_master WHERE name IN (?, ?)", (table_name, f"{table_name}_dict")
+    ).fetchall())
+    if table_name not in kinds:
+        return None
+    if kinds[table_name] == "view":
+        return "view"
+    return "compact" if f"{table_name}_dict" in kinds else "table"
 
+def write_compact_melt(conn, table_name, mdf, float32=False):
+    """
+    Store a melted DataFrame with every label column dictionary-encoded.
 
-    if group in [x_col, row_var, col_var]:
-        p = p + theme(legend_position='none')
-    else:
-        p = p + theme(legend_position='left')
-        panel_width = panel_width + 4 + (n_groups * 0.3)
+    Categorical and Vars columns become INTEGER codes into {table_name}_dict
+    (col, code, label) and value is stored as REAL, rounded to float32
+    precision when float32 is set.
+    """
+    label_cols = [c for c in mdf.columns if c != "value"]
+    col_sql = ", ".join([f"{quote_ident(c)} INTEGER" for c in label_cols] + ["value REAL"])
+    conn.execute(f"CREATE TABLE {table_name} ({col_sql})")
+    conn.execute(f"CREATE TABLE {table_name}_dict (col TEXT, code INTEGER, label, PRIMARY KEY (col, code))")
+    append_compact_melt(conn, table_name, mdf, float32=float32)
 
-    if row_var and row_var != "." and row_var in df.columns:
-        nrow = df[row_var].nunique()
-    else:
-        nrow = 1
+def append_compact_melt(conn, table_name, mdf, float32=False):
+    """
+    Append melted rows to a compact table.
 
-    if col_var and col_var != "." and col_var in df.columns:
-        ncol = df[col_var].nunique()
-    else:
-        ncol = 1
+    Labels already in the dictionary keep their code, new labels get the next
+    free codes in order of first appearance so plots keep the upload order.
+    """
+    # pandas is imported on first use, see plotting.py
+    import pandas as pd
+
+    label_cols = [c for c in mdf.columns if c != "value"]
+    dict_rows = []
+    encoded = {}
+    for col in label_cols:
+        known = dict(conn.execute(f"SELECT label, code FROM {table_name}_dict WHERE col = ?", (col,)).fetchall())
+        next_code = max(known.values(), default=-1) + 1
+        codes, uniques = pd.factorize(mdf[col], sort=False)
+        for label in uniques.tolist():
+            if label not in known:
+                known[label] = next_code
+                dict_rows.append((col, next_code, label))
+                next_code += 1
+        lookup = pd.Series([known[label] for label in uniques.tolist()], dtype="int64")
+        # Missing labels (code -1) stay NULL
+        encoded[col] = pd.Series(codes, index=mdf.index).map(lookup)
+
+    value = pd.to_numeric(mdf["value"], errors="coerce")
+    if float32:
+        value = value.astype("float32")
+    encoded["value"] = value.astype("float64")
+    enc = pd.DataFrame(encoded)
+
+    conn.executemany(f"INSERT INTO {table_name}_dict VALUES (?, ?, ?)", dict_rows)
+    write_frame(conn, table_name, enc)
+
+def update_melt(conn, old_table, new_table, source_table, categorical, added, removed, float32=False):
+    """
+    Bring a melted table up to date with a changed marker selection.
 
-    # Total figure size
-    fig_width = panel_width * ncol
-    fig_height =(min_panel_height * nrow ) + 1
+    Only the Vars slices of removed markers are deleted and only the added
+    markers are melted and appended, so the kept markers must stay in their
+    old order with the added ones after them. The table is then renamed to new_table,
+    so nothing cached or ETagged under the old name is served for the new data.
+    """
+    import pandas as pd
+
+    compact = melt_format(conn, old_table) == "compact"
+    # The summary is per (categorical..., Vars) cell, so it changes slice by slice too
+    summary = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{old_table}_summary",)
+    ).fetchone()
+    if removed:
+        placeholders = ", ".join("?" for _ in removed)
+        if compact:
+            codes = [row[0] for row in conn.execute(
+                f"SELECT code FROM {old_table}_dict WHERE col = 'Vars' AND label IN ({placeholders})", removed)]
+            code_placeholders = ", ".join("?" for _ in codes)
+            conn.execute(f"DELETE FROM {old_table} WHERE Vars IN ({code_placeholders})", codes)
+            conn.execute(f"DELETE FROM {old_table}_dict WHERE col = 'Vars' AND code IN ({code_placeholders})", codes)
+        else:
+            conn.execute(f"DELETE FROM {old_table} WHERE Vars IN ({placeholders})", removed)
+        if summary:
+            conn.execute(f"DELETE FROM {old_table}_summary WHERE Vars IN ({placeholders})", removed)
+
+    if added:
+        # Unknown double-quoted names would silently become string literals
+        existing = set(table_columns(conn, source_table))
+        missing = [c for c in categorical + added if c not in existing]
+        if missing:
+            raise sqlite3.OperationalError(f"no such column: {', '.join(missing)}")
+        columns_sql = ", ".join(quote_ident(c) for c in categorical + added)
+        df = pd.read_sql(f"SELECT {columns_sql} FROM {source_table}", con=conn)
+        mdf = df.melt(id_vars=categorical, var_name="Vars")
+        rows_processed.observe("melt", len(mdf))
+        if compact:
+            append_compact_melt(conn, old_table, mdf, float32=float32)
+        else:
+            write_frame(conn, old_table, mdf)
+        if summary:
+            write_summary(conn, old_table, mdf)
+
+    conn.execute(f"ALTER TABLE {old_table} RENAME TO {new_table}")
+    if compact:
+        conn.execute(f"ALTER TABLE {old_table}_dict RENAME TO {new_table}_dict")
+    if summary:
+        conn.execute(f"ALTER TABLE {old_table}_summary RENAME TO {new_table}_summary")
+    conn.execute(
+        "UPDATE table_lifetime SET id = ?, Created = ? WHERE id = ?",
+        (new_table, datetime.now(timezone.utc).isoformat(), old_table)
+    )
 
+def index_columns(conn, table_name, columns):
+    """Index each label column of a table so filters and DISTINCT lookups don't scan it"""
+    for col in columns:
+        suffix = hashlib.sha1(str(col).encode("utf-8")).hexdigest()[:8]
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_idx_{suffix} ON {table_name} ({quote_ident(col)})")
 
+def table_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
 
-    buf = StringIO()
-    p.save(buf, format="svg", width=fig_width, height= fig_height,
-           limitsize=False, verbose=False, bbox_inches='tight')
-    buf.seek(0)
+def filter_clause(conn, table_name, filters, compact=False):
+    """
+    Parameterized WHERE clause for category filters.
+
+    filters maps a column to the labels to keep. Compact tables are filtered
+    on the dictionary codes of those labels. Returns (sql, params).
+    """
+    conditions = []
+    params = []
+    for col, labels in (filters or {}).items():
+        values = list(labels)
+        if compact:
+            allowed = {str(label) for label in labels}
+            values = [code for code, label in conn.execute(
+                f"SELECT code, label FROM {table_name}_dict WHERE col = ?", (col,)) if str(label) in allowed]
+        if not values:
+            conditions.append("0")
+            continue
+        conditions.append(f"{quote_ident(col)} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    if not conditions:
+        return "", []
+    return " WHERE " + " AND ".join(conditions), params
 
-    return buf.read()
+def filter_frame(df, filters):
+    """The in-memory counterpart of filter_clause"""
+    import pandas as pd
 
-def remove_colname_upto_symbol(df, symbol):
-    escaped = re.escape(symbol)
-    pattern = rf'^.*?{escaped}'
-    df.columns = df.columns.str.replace(pattern, '', regex=True)
+    for col, labels in (filters or {}).items():
+        df = df[df[col].astype(str).isin([str(label) for label in labels])]
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df = df.assign(**{col: df[col].cat.remove_unused_categories()})
     return df
 
-def table_timestamp(table_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        created = datetime.now(timezone.utc).isoformat()  
-        conn.execute(
-            "INSERT INTO table_lifetime (id, Created) VALUES (?, ?)",
-            (table_id, created)
-        )
-        conn.commit()
+def read_session_table(conn, table_name, columns=None, filters=None):
+    """
+    Load a session table into pandas.
 
-def get_discrete_cmap_colors(n_colors, cmap):
+    Only the given columns and the rows passing filters (see filter_clause)
+    are read, both pushed down into the query. Compact melted tables are
+    rehydrated straight into category dtype from their dictionary, other
+    tables and views are read as they are.
     """
-    Get n discrete colors from a matplotlib colormap
-    
-    Args:
-        n_colors: number of colors needed
-        cmap: colormap name ('Accent', 'Accent_r', 'Blues', 'Blues_r', 'BrBG', 'BrBG_r',
-            'BuGn', 'BuGn_r', 'BuPu', 'BuPu_r', 'CMRmap', 'CMRmap_r', 'Dark2', 'Dark2_r', 
-            'GnBu', 'GnBu_r', 'Grays', 'Greens', 'Greens_r', 'Greys', 'Greys_r', 'OrRd', 
-            'OrRd_r', 'Oranges', 'Oranges_r', 'PRGn', 'PRGn_r', 'Paired', 'Paired_r', 
-            'Pastel1', 'Pastel1_r', 'Pastel2', 'Pastel2_r', 'PiYG', 'PiYG_r', 'PuBu', 
-            'PuBuGn', 'PuBuGn_r', 'PuBu_r', 'PuOr', 'PuOr_r', 'PuRd', 'PuRd_r', 'Purples',
-            'Purples_r', 'RdBu', 'RdBu_r', 'RdGy', 'RdGy_r', 'RdPu', 'RdPu_r', 'RdYlBu', 
-            'RdYlBu_r', 'RdYlGn', 'RdYlGn_r', 'Reds', 'Reds_r', 'Set1', 'Set1_r', 'Set2',
-            'Set2_r', 'Set3', 'Set3_r', 'Spectral', 'Spectral_r', 'Wistia', 'Wistia_r', 
-            'YlGn', 'YlGnBu', 'YlGnBu_r', 'YlGn_r', 'YlOrBr', 'YlOrBr_r', 'YlOrRd', 
-            'YlOrRd_r', 'afmhot', 'afmhot_r', 'autumn', 'autumn_r', 'binary', 'binary_r', 
-            'bone', 'bone_r', 'brg', 'brg_r', 'bwr', 'bwr_r', 'cividis', 'cividis_r', 
-            'cool', 'cool_r', 'coolwarm', 'coolwarm_r', 'copper', 'copper_r', 'cubehelix', 
-            'cubehelix_r', 'flag', 'flag_r', 'gist_earth', 'gist_earth_r', 'gist_gray', 
-            'gist_gray_r', 'gist_grey', 'gist_heat', 'gist_heat_r', 'gist_ncar', 'gist_ncar_r', 
-            'gist_rainbow', 'gist_rainbow_r', 'gist_stern', 'gist_stern_r', 'gist_yarg', 'gist_yarg_r', 
-            'gist_yerg', 'gnuplot', 'gnuplot2', 'gnuplot2_r', 'gnuplot_r', 'gray', 'gray_r', 'grey', 
-            'hot', 'hot_r', 'hsv', 'hsv_r', 'inferno', 'inferno_r', 'jet', 'jet_r', 'magma', 'magma_r', 
-            'nipy_spectral', 'nipy_spectral_r', 'ocean', 'ocean_r', 'pink', 'pink_r', 'plasma', 
-            'plasma_r', 'prism', 'prism_r', 'rainbow', 'rainbow_r', 'seismic', 'seismic_r', 'spring', 
-            'spring_r', 'summer', 'summer_r', 'tab10', 'tab10_r', 'tab20', 'tab20_r', 'tab20b', 'tab20b_r', 
-            'tab20c', 'tab20c_r', 'terrain', 'terrain_r', 'turbo', 'turbo_r', 'twilight', 'twilight_r', 
-            'twilight_shifted', 'twilight_shifted_r', 'viridis', 'viridis_r', 'winter', 'winter_r')
-    
-    Returns:
-        list of hex color codes
+    import pandas as pd
+
+    compact = melt_format(conn, table_name) == "compact"
+    columns_sql = "*" if columns is None else ", ".join(quote_ident(c) for c in columns)
+    where, params = filter_clause(conn, table_name, filters, compact=compact)
+    with stage("read_sql"):
+        df = pd.read_sql(f"SELECT {columns_sql} FROM {table_name}{where}", con=conn, params=params)
+    rows_processed.observe("read", len(df))
+    if not compact:
+        return df
+
+    labels = pd.read_sql(f"SELECT col, code, label FROM {table_name}_dict ORDER BY col, code", con=conn)
+    for col, entries in labels.groupby("col", sort=False):
+        if col not in df.columns:
+            continue
+        # Codes can have gaps once markers were removed, map them to positions
+        positions = pd.Index(entries["code"]).get_indexer(df[col])
+        df[col] = pd.Categorical.from_codes(positions, categories=entries["label"].tolist())
+        if filters and col in filters:
+            # Filtered out labels would still show up in legends and scales
+            df[col] = df[col].cat.remove_unused_categories()
+    if config.MELT_VALUE_FLOAT32:
+        df["value"] = df["value"].astype("float32")
+    return df
+
+def write_summary(conn, table_name, mdf, create=None):
     """
-    colormap = cm.get_cmap(cmap)
-    # Sample colors evenly across the colormap
-    colors = [mcolors.rgb2hex(colormap(i / (n_colors - 1 if n_colors > 1 else 1))) 
-              for i in range(n_colors)]
-    
-    return colors
+    Append the cell summary of mdf to {table_name}_summary, creating it if needed.
+
+    create=True always creates the table, failing if it already exists
+    instead of appending a second copy of the cells.
+    """
+    summary = summarize_melt(mdf)
+    if create is None:
+        create = not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_summary",)
+        ).fetchone()
+    write_frame(conn, f"{table_name}_summary", summary, create=create)
+    return summary
+
+def read_summary(conn, table_name, filters=None):
+    """The cell summary of a melted table, limited to the cells passing filters, or None if it has none"""
+    import pandas as pd
+
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_summary",)
+    ).fetchone()
+    if not exists:
+        return None
+    # Every filter column is a cell key, so filtering cells is exact
+    where, params = filter_clause(conn, f"{table_name}_summary", filters)
+    return pd.read_sql(f"SELECT * FROM {table_name}_summary{where}", con=conn, params=params)
+
+def read_levels(conn, table_name, columns, limit, source_table=None, markers=None):
+    """
+    Labels of each column for the graph form's filter lists.
+
+    The Vars labels are the melted markers when they are given. Other columns
+    are read from the dictionary or summary when the melt has one, otherwise
+    with DISTINCT queries on the indexed columns of source_table, the
+    uploaded table, so a melt view is never scanned. Columns with more than
+    limit labels are left out.
+    """
+    fmt = melt_format(conn, table_name)
+    has_summary = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_summary",)
+    ).fetchone()
+    levels = {}
+    for col in columns:
+        if col == "Vars" and markers is not None:
+            labels = [str(marker) for marker in markers]
+            if len(labels) <= limit:
+                levels[col] = labels
+            continue
+        if fmt == "compact":
+            query, params = f"SELECT label FROM {table_name}_dict WHERE col = ? ORDER BY code LIMIT ?", (col, limit + 1)
+        else:
+            source = f"{table_name}_summary" if has_summary else source_table or table_name
+            query = f"SELECT DISTINCT {quote_ident(col)} FROM {source} WHERE {quote_ident(col)} IS NOT NULL LIMIT ?"
+            params = (limit + 1,)
+        labels = [str(row[0]) for row in conn.execute(query, params)]
+        if len(labels) <= limit:
+            levels[col] = labels
+    return levels
+
+def create_melt_view(conn, view_name, source_table, categorical, continuous):
+    """
+    Register the long format of source_table as a view instead of writing it out.
+
+    Each continuous column becomes one UNION ALL branch, giving the same
+    (categorical..., Vars, value) rows and order as DataFrame.melt.
+    """
+    # Unknown double-quoted names would silently become string literals
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({source_table})")}
+    missing = [c for c in categorical + continuous if c not in existing]
+    if missing:
+        raise sqlite3.OperationalError(f"no such column: {', '.join(missing)}")
+
+    id_sql = ", ".join(quote_ident(c) for c in categorical)
+    branches = [
+        f"SELECT {id_sql}, {quote_literal(c)} AS Vars, {quote_ident(c)} AS value FROM {source_table}"
+        for c in continuous
+    ]
+    conn.execute(f"CREATE VIEW {view_name} AS " + " UNION ALL ".join(branches))
+
+def summarize_markers(conn, source_table, categorical, markers):
+    """
+    Cell summary of each marker's slice of the melt of source_table, by marker.
+
+    The wide columns are read once and summarized one marker at a time, so
+    the long format is never loaded. Every slice has the same id rows, so
+    concatenating the summaries in marker order gives the same cells in the
+    same order as summarizing the melted rows.
+    """
+    import pandas as pd
+
+    columns_sql = ", ".join(quote_ident(c) for c in categorical + markers)
+    with stage("read_sql"):
+        df = pd.read_sql(f"SELECT {columns_sql} FROM {source_table}", con=conn)
+    rows_processed.observe("read", len(df))
+    ids = df[categorical]
+    return {marker: summarize_melt(ids.assign(Vars=marker, value=df[marker])) for marker in markers}
+
+def write_view_summary(conn, view_name, source_table, categorical, continuous):
+    """Store the cell summary of a melt view, built from its source table by summarize_markers()"""
+    import pandas as pd
+
+    by_marker = summarize_markers(conn, source_table, categorical, continuous)
+    summary = pd.concat([by_marker[marker] for marker in continuous], ignore_index=True)
+    write_frame(conn, f"{view_name}_summary", summary, create=True)
+    return summary
+
+def update_melt_view(conn, old_view, new_view, source_table, categorical, continuous):
+    """
+    Replace a melt view with one over a changed marker selection, in any order.
+
+    The view itself is only a query, the cost is in its summary: kept markers
+    take their cells from the old summary, only the added markers are read
+    and summarized. The old view is dropped and its table_lifetime row moves
+    to new_view. Returns the new summary, or None if the old view had none.
+    """
+    import pandas as pd
+
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{old_view}_summary",)
+    ).fetchone():
+        return None
+    old = read_summary(conn, old_view)
+    kept = {marker: cells for marker, cells in old.groupby("Vars", sort=False)}
+    added = summarize_markers(conn, source_table, categorical, [c for c in continuous if c not in kept])
+
+    create_melt_view(conn, new_view, source_table, categorical, continuous)
+    summary = pd.concat([kept[marker] if marker in kept else added[marker] for marker in continuous],
+                        ignore_index=True)
+    write_frame(conn, f"{new_view}_summary", summary, create=True)
+
+    drop_relation(conn, old_view)
+    conn.execute(
+        "UPDATE table_lifetime SET id = ?, Created = ? WHERE id = ?",
+        (new_view, datetime.now(timezone.utc).isoformat(), old_view)
+    )
+    return summary
+
+def read_table_page(conn, table_name, columns=None, limit=100, offset=0):
+    """
+    Read one page of a session table for the data preview.
+
+    Only the requested columns are selected and compact tables are decoded
+    page by page, so the cost depends on the page size, not the table size.
+    Returns (columns, rows, has_more).
+    """
+    existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    if columns:
+        missing = [c for c in columns if c not in existing]
+        if missing:
+            raise ValueError(f"Unknown columns: {', '.join(missing)}")
+    else:
+        columns = existing
+
+    col_sql = ", ".join(quote_ident(c) for c in columns)
+    # One extra row tells whether another page exists
+    rows = conn.execute(
+        f"SELECT {col_sql} FROM {table_name} LIMIT ? OFFSET ?", (limit + 1, offset)
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = [list(r) for r in rows[:limit]]
+
+    has_dict = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_dict",)
+    ).fetchone()
+    if has_dict:
+        labels = {}
+        for col, code, label in conn.execute(f"SELECT col, code, label FROM {table_name}_dict"):
+            labels.setdefault(col, {})[code] = label
+        for i, col in enumerate(columns):
+            if col in labels:
+                for r in rows:
+                    r[i] = labels[col].get(r[i])
+
+    return columns, rows, has_more
+
+def upload_hash(stream, options):
+    """sha256 of an upload's raw bytes and its preprocessing options, the stream is rewound"""
+    digest = hashlib.sha256(repr(options).encode("utf-8"))
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def acquire_table(conn, content_hash):
+    """
+    Take a reference on the ingested table with this content hash.
+
+    Returns its name, or None if there is no such table. Its lifetime starts
+    over, so the expiry sweep only drops it TABLE_TTL_HOURS after the last
+    session picked it up.
+    """
+    row = conn.execute(
+        "SELECT id FROM table_lifetime WHERE content_hash = ? ORDER BY Created DESC LIMIT 1", (content_hash,)
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(
+        "UPDATE table_lifetime SET refs = refs + 1, Created = ? WHERE id = ?",
+        (datetime.now(timezone.utc).isoformat(), row[0])
+    )
+    return row[0]
+
+def touch_table(conn, table_name):
+    """
+    Start a table's lifetime over, e.g. an uploaded table a new melt view reads.
+
+    The expiry sweep drops a table TABLE_TTL_HOURS after its Created time
+    regardless of views over it, so a view must not outlive its source.
+    """
+    conn.execute(
+        "UPDATE table_lifetime SET Created = ? WHERE id = ?",
+        (datetime.now(timezone.utc).isoformat(), table_name)
+    )
+
+def release_table(conn, table_name):
+    """Drop one reference to a table, and the table with the last one. Returns True if it was dropped"""
+    row = conn.execute("SELECT refs FROM table_lifetime WHERE id = ?", (table_name,)).fetchone()
+    if row is not None and row[0] > 1:
+        conn.execute("UPDATE table_lifetime SET refs = refs - 1 WHERE id = ?", (table_name,))
+        return False
+    # Delete table
+    drop_relation(conn, table_name)
+    # Remove from tracking table
+    conn.execute("DELETE FROM table_lifetime WHERE id = ?", (table_name,))
+    return True
+
+def drop_table(table_name):
+    if not table_name:
+        return
+    try:
+        with transaction() as conn:
+            dropped = release_table(conn, table_name)
+        if dropped:
+            invalidate_table_caches(table_name)
+    except Exception as e:
+        return str(e)
+
+def write_frame(conn, table_name, df, create=False):
+    """
+    Insert a DataFrame into table_name on an open connection without committing,
+    so several chunks can share the caller's transaction (pandas' to_sql commits).
+    """
+    import pandas as pd
+
+    if create:
+        conn.execute(pd.io.sql.get_schema(df, table_name, con=conn))
+    placeholders = ", ".join("?" for _ in df.columns)
+    conn.executemany(
+        f"INSERT INTO {table_name} VALUES ({placeholders})",
+        df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    )
+
+def table_timestamp(table_id, content_hash=None):
+    # Joins the caller's transaction, so a table and its row commit together
+    with transaction() as conn:
+        created = datetime.now(timezone.utc).isoformat()  
+        conn.execute(
+            "INSERT INTO table_lifetime (id, Created, content_hash) VALUES (?, ?, ?)",
+            (table_id, created, content_hash)
+        )
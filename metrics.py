@@ -0,0 +1,114 @@
+"""
+Request instrumentation
+
+stage() times a block with a monotonic clock, feeds a latency histogram and
+remembers the timing for the current thread so the app can report it in a
+Server-Timing header. Render workers send their stage timings back with each
+result. render_prometheus() renders every metric in Prometheus text format
+for /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+ROWS_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, thread-safe"""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}   # label value -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.setdefault(label_value, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total, count) in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label}}} {total:g}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+stage_seconds = Histogram("flowgraph_stage_seconds", "Duration of pipeline stages", "stage", SECONDS_BUCKETS)
+request_seconds = Histogram("flowgraph_request_seconds", "Request latency by endpoint", "endpoint", SECONDS_BUCKETS)
+rows_processed = Histogram("flowgraph_rows", "Rows handled per operation", "operation", ROWS_BUCKETS)
+output_bytes = Histogram("flowgraph_output_bytes", "Size of rendered plots", "format", BYTES_BUCKETS)
+cleanup_seconds = Histogram("flowgraph_cleanup_seconds", "Duration of expiry sweeps", "job", SECONDS_BUCKETS)
+
+
+def _pending():
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        timings = _local.timings = []
+    return timings
+
+
+def record_stage(name, seconds):
+    """Record a finished stage for this thread and the stage histogram"""
+    _pending().append((name, seconds))
+    stage_seconds.observe(name, seconds)
+
+
+def record_stages(timings):
+    """Record stage timings measured elsewhere, e.g. in a render worker"""
+    for name, seconds in timings:
+        record_stage(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def drain_stages():
+    """Return and forget the stage timings recorded on this thread"""
+    timings = _pending()
+    _local.timings = []
+    return timings
+
+
+def server_timing_header(timings):
+    """Server-Timing header value, durations in milliseconds"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+
+
+def render_prometheus(gauges=()):
+    """
+    All histograms plus the given gauges in Prometheus text format.
+
+    gauges is a sequence of (name, type, help, value) tuples.
+    """
+    lines = []
+    for hist in (request_seconds, stage_seconds, rows_processed, output_bytes, cleanup_seconds):
+        lines.extend(hist.render())
+    for name, kind, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,359 @@
+"""
+Plot building and rendering
+
+Imports plotnine, matplotlib and numpy at module load, so it is only imported
+by the code paths that draw a plot: the render workers, the in-process render
+fallback and /download_plot. warm_up() pays the one-off costs of a fresh
+process (imports, font cache, first figure) before the first real request.
+"""
+from io import StringIO, BytesIO
+import textwrap
+import matplotlib
+matplotlib.use("Agg")
+from plotnine import (
+    ggplot, aes,
+    geom_jitter, geom_boxplot, geom_col, geom_errorbar,
+    position_jitterdodge, position_dodge,
+    scale_x_discrete,
+    facet_grid,
+    guides, guide_legend,
+    theme_classic, theme,
+    element_rect, element_text, element_blank,
+    scale_fill_manual, labs
+) 
+import numpy as np
+import pandas as pd
+import config
+from cell_stats import (
+    plot_keys, summary_cells, summarize_melt, figure_layout, discrete_levels, get_discrete_cmap_colors
+)
+from metrics import stage
+
+_warm = False
+
+
+def wrap_labels(text, width=20):
+    return [textwrap.fill(label, width=width) for label in text]
+
+def summarize_groups(df, keys):
+    """
+    Summary statistics of value per plotted cell in one vectorized groupby:
+    n, mean, median, sd and sem.
+    """
+    summary = (df.groupby(keys, observed=True, sort=False)["value"]
+                 .agg(n="count", mean="mean", median="median", sd="std")
+                 .reset_index())
+    summary["sd"] = summary["sd"].fillna(0)
+    summary["sem"] = summary["sd"] / np.sqrt(summary["n"])
+    return summary
+
+def downsample_cells(df, keys, cap, seed=0):
+    """
+    Stratified sample of at most cap rows from every plotted cell.
+
+    The seed is fixed so the same request always draws the same points.
+    """
+    if len(df) <= cap:
+        return df
+    rng = np.random.default_rng(seed)
+    shuffled = df.iloc[rng.permutation(len(df))]
+    keep = shuffled.groupby(keys, observed=True, sort=False).cumcount() < cap
+    return shuffled[keep.to_numpy()].sort_index()
+
+def plot_theme(spec):
+    """Theme shared by every plot of a spec"""
+    custom_theme = theme_classic() + theme(
+        plot_background=element_rect(fill='none'),
+        panel_background=element_rect(fill='none'),
+        legend_background=element_rect(fill='none'),
+        legend_key=element_rect(fill='none', color='none'),
+        legend_text=element_text(size=8),           # Legend item text size
+        legend_title=element_text(size=8),
+        axis_text_x=element_text(angle=90, ha='right', size=9, color='black'),
+        axis_text_y=element_text(size=9, color='black'),
+        axis_title_y=element_blank()
+    )
+
+    if spec["xaxis"] == 'Vars':
+        custom_theme = custom_theme + theme(axis_title_x=element_blank())
+    return custom_theme
+
+def build_graph(df, spec, palette_colors=None, custom_theme=None, summary=None):
+    """
+    Build the ggplot object for a plot spec.
+
+    spec holds the /graph form selections: xaxis, frows, fcols, group,
+    palette and graph_type. Returns the plot and the number of fill groups.
+    A batch passes its shared palette_colors (a level -> color dict) and
+    custom_theme so they are only computed once. With the melt summary the
+    levels, box and bar statistics come from it instead of the rows, and df
+    may be None for bar charts the summary covers.
+    """
+    xaxis = spec["xaxis"]
+    frows = spec["frows"]
+    fcols = spec["fcols"]
+    group = spec["group"]
+    # Levels and cardinalities, from the few summary rows when available
+    cells = df if summary is None else summary
+
+    # Generate colors
+    if palette_colors is None:
+        n_groups = cells[group].nunique()
+        palette_colors = get_discrete_cmap_colors(n_groups, cmap=spec["palette"])
+    else:
+        n_groups = len(palette_colors)
+
+    if custom_theme is None:
+        custom_theme = plot_theme(spec)
+
+    if spec["graph_type"] == 'Boxplot':
+        # Large data: boxes still use every row, the jitter layer is either
+        # capped per cell or drawn as one embedded bitmap. Admission control
+        # may set its own cap, 0 draws the boxes only
+        points = df
+        raster = False
+        if spec.get("jitter_cap") is not None:
+            cap = spec["jitter_cap"]
+            points = downsample_cells(df, plot_keys(spec), cap) if cap else None
+        elif len(df) > config.BOXPLOT_LARGE_N_THRESHOLD:
+            if config.BOXPLOT_LARGE_N_MODE == "raster":
+                raster = True
+            else:
+                points = downsample_cells(df, plot_keys(spec), config.BOXPLOT_JITTER_CAP_PER_CELL)
+
+        # Precomputed boxes when the plot splits the data like the summary
+        box_stats = None if summary is None else summary_cells(summary, plot_keys(spec), "box")
+        if box_stats is not None:
+            # Same level order as the rows, or boxes and points dodge differently
+            box_stats = box_stats[box_stats["n"] > 0].copy()
+            for col in plot_keys(spec):
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    box_stats[col] = pd.Categorical(box_stats[col], categories=df[col].cat.categories)
+            boxes = geom_boxplot(aes(x=xaxis, fill=group, lower="q1", middle="median", upper="q3",
+                                     ymin="whisker_low", ymax="whisker_high"),
+                                 data=box_stats, stat="identity", inherit_aes=False,
+                                 width=0.4, alpha=0.2, color='black',
+                                 position=position_dodge(width=0.6), show_legend=points is None)
+        else:
+            boxes = geom_boxplot(width=0.4, alpha=0.2, color='black',
+                                 position=position_dodge(width=0.6), 
+                                 show_legend=points is None, outlier_shape='')
+
+        graph = ggplot(df, aes(x=xaxis, y="value", fill=group))
+        if points is not None:
+            graph = graph + geom_jitter(data=points, size=1.75, raster=raster,
+                                        position=position_jitterdodge(jitter_width=0.1, dodge_width=0.6))
+        graph = (graph + 
+                boxes + 
+                scale_x_discrete(limits=cells[xaxis].unique(), labels=wrap_labels) + 
+                guides(fill=guide_legend(override_aes={'size': 4})) +
+                scale_fill_manual(values=palette_colors) +
+                custom_theme)
+    else:
+        # One bar per cell: aggregate first so the plot size depends on the
+        # number of groups, not the number of rows
+        stat = spec.get("bar_stat") or "mean"
+        bars = None if summary is None else summary_cells(summary, plot_keys(spec), stat)
+        if bars is None:
+            bars = summarize_groups(df, plot_keys(spec))
+        bars = bars.copy()
+        bars["value"] = bars[stat]
+
+        graph = (ggplot(bars, aes(x=xaxis, y="value", fill=group)) + 
+                geom_col(width=0.6, color='black',
+                            position=position_dodge(width=0.8)) + 
+                scale_x_discrete(limits=cells[xaxis].unique(),labels=wrap_labels) + 
+                guides(fill=guide_legend(override_aes={'size': 0.5})) +
+                scale_fill_manual(values=palette_colors) +
+                custom_theme)
+
+        error_bars = spec.get("error_bars")
+        if error_bars in ("sd", "sem"):
+            bars["ymin"] = bars["value"] - bars[error_bars]
+            bars["ymax"] = bars["value"] + bars[error_bars]
+            graph = graph + geom_errorbar(aes(ymin="ymin", ymax="ymax", group=group),
+                                          width=0.25, position=position_dodge(width=0.8))
+
+    # Only add facet_grid if one facet variable exists
+    if frows != "." or fcols != ".":
+        facet = f"{frows}~{fcols}"
+        graph = graph + facet_grid(facet, scales='free')
+
+    # Says how admission control simplified the plot
+    if spec.get("note"):
+        graph = graph + labs(caption=spec["note"])
+
+    return graph, n_groups
+
+def render_graph(df, spec, format="svg", dpi=config.PLOT_RASTER_DPI, summary=None):
+    """
+    Build the plot for spec and render it at its dynamic size.
+
+    Returns an SVG string, or the file bytes for format "png" or "pdf".
+    """
+    with stage("ggplot_build"):
+        graph, n_groups = build_graph(df, spec, summary=summary)
+
+    # Plot to custom size, the summary has the same levels as the rows
+    return plotnine_to_svgString_dynasize(p=graph, df=df if summary is None else summary,
+                                          group=spec["group"], n_groups=n_groups,
+                                          x_col=spec["xaxis"],
+                                          row_var=spec["frows"],
+                                          col_var=spec["fcols"],
+                                          dpi=dpi, format=format)
+
+def render_graph_batch(df, spec, split_by, levels, format="svg", dpi=config.PLOT_RASTER_DPI, summary=None,
+                       notes=None):
+    """
+    Render one plot of spec per value of split_by.
+
+    The theme and palette are built once for the whole batch, and the palette
+    maps the group levels of the full data set, in discrete_levels() order,
+    so every plot uses the same colors as a single plot of the data. notes
+    maps a value to the caption of its plot, replacing spec's. Returns a list of (value, figure) in order of appearance.
+    """
+    palette_colors = dict(zip(levels, get_discrete_cmap_colors(len(levels), cmap=spec["palette"])))
+    custom_theme = plot_theme(spec)
+
+    figs = []
+    for value, part in (df if df is not None else summary).groupby(split_by, observed=True, sort=False):
+        part_summary = None if summary is None else summary[summary[split_by] == value]
+        part_df = None if df is None else part
+        part_spec = spec if notes is None else {**spec, "note": notes.get(value)}
+        with stage("ggplot_build"):
+            graph, n_groups = build_graph(part_df, part_spec, palette_colors, custom_theme, part_summary)
+        figs.append((value, plotnine_to_svgString_dynasize(p=graph, df=part if summary is None else part_summary,
+                                                           group=spec["group"],
+                                                           n_groups=n_groups,
+                                                           x_col=spec["xaxis"],
+                                                           row_var=spec["frows"],
+                                                           col_var=spec["fcols"],
+                                                           dpi=dpi, format=format)))
+    return figs
+
+def plot_geometry(df, spec, summary=None):
+    """
+    Compact description of the plot of spec for drawing it in the browser.
+
+    Instead of a figure it returns what the figure is drawn from: the levels
+    of every plotted column, one row of box or bar statistics per cell, the
+    jitter points of boxplots (at most CLIENT_POINTS_PER_CELL per cell) and
+    the figure layout. Cells and points are columns of level indexes, so
+    labels are sent once. The palette is not part of it, the browser colors
+    the fill groups from /plot_colors.
+    """
+    keys = plot_keys(spec)
+    stat = spec.get("bar_stat") or "mean"
+    is_box = spec["graph_type"] == 'Boxplot'
+
+    # Cell statistics from the melt summary when it splits the data like the
+    # plot, else one grouped pass over the rows
+    cells = None if summary is None else summary_cells(summary, keys, "box" if is_box else stat)
+    if cells is None:
+        cells = summarize_melt(df[keys + ["value"]])
+    cells = cells[cells["n"] > 0]
+    levels_from = df if summary is None else summary
+
+    def levels(col):
+        # x keeps the order of appearance like scale_x_discrete(limits=...),
+        # fills and facets the order plotnine gives them
+        values = levels_from[col]
+        if col == spec["xaxis"]:
+            return list(values.dropna().unique())
+        return discrete_levels(values)
+
+    axes = {"x": spec["xaxis"], "group": spec["group"], "row": spec["frows"], "col": spec["fcols"]}
+    axis_levels = {axis: levels(col) if col != "." else [None] for axis, col in axes.items()}
+    n_groups = len(axis_levels["group"])
+
+    def codes(frame):
+        # Level index of each row on every axis, 0 on an unused facet axis
+        return {axis: (pd.Categorical(frame[col], categories=axis_levels[axis]).codes.tolist()
+                       if col != "." else [0] * len(frame))
+                for axis, col in axes.items()}
+
+    def numbers(values):
+        # JSON has no NaN
+        return [None if np.isnan(v) else round(float(v), 6) for v in values]
+
+    stats = ["n", "q1", "median", "q3", "whisker_low", "whisker_high"] if is_box else ["n", stat, "sd", "sem"]
+    geometry = {
+        "graph_type": spec["graph_type"],
+        "columns": axes,
+        "levels": {axis: [None if v is None else str(v) for v in values] for axis, values in axis_levels.items()},
+        "bar_stat": stat,
+        "error_bars": spec.get("error_bars") or "none",
+        "cells": {**codes(cells), **{s: numbers(cells[s].to_numpy(dtype=float)) for s in stats}},
+    }
+    if is_box:
+        points = downsample_cells(df[keys + ["value"]], keys, config.CLIENT_POINTS_PER_CELL)
+        geometry["points"] = {**codes(points), "value": numbers(points["value"].to_numpy(dtype=float))}
+
+    panel_width, nrow, ncol, legend = figure_layout(levels_from, spec["xaxis"], spec["frows"], spec["fcols"],
+                                                    spec["group"], n_groups)
+    geometry["layout"] = {
+        # The browser sizes the legend itself
+        "panel_width": panel_width - (4 + n_groups * 0.3 if legend else 0),
+        "panel_height": config.PLOT_PANEL_HEIGHT,
+        "nrow": nrow,
+        "ncol": ncol,
+        "legend": legend,
+    }
+    return geometry
+
+def plotnine_to_svgString_dynasize(p, df, x_col, row_var, col_var, group, n_groups,
+                             base_width_per_tick = config.PLOT_BASE_WIDTH_PER_TICK,
+                             min_panel_width = config.PLOT_MIN_PANEL_WIDTH,
+                             min_panel_height = config.PLOT_PANEL_HEIGHT,
+                             dpi = config.PLOT_RASTER_DPI,
+                             format = "svg"):
+
+    panel_width, nrow, ncol, legend = figure_layout(df, x_col, row_var, col_var, group, n_groups,
+                                                    base_width_per_tick, min_panel_width)
+    p = p + theme(legend_position='left' if legend else 'none')
+
+    # Total figure size
+    fig_width = panel_width * ncol
+    fig_height =(min_panel_height * nrow ) + 1
+
+
+    # Binary exports for /download_plot, at the dpi admission allowed
+    if format != "svg":
+        buf = BytesIO()
+        with stage(f"{format}_save"):
+            p.save(buf, format=format, width=fig_width, height= fig_height, dpi=dpi,
+                   limitsize=False, verbose=False, bbox_inches='tight')
+        return buf.getvalue()
+
+    # Rasterized layers scale with area x dpi^2, lower the dpi of large
+    # figures so the embedded bitmap stays within PLOT_MAX_RASTER_PIXELS
+    dpi = min(dpi, (config.PLOT_MAX_RASTER_PIXELS / (fig_width * fig_height)) ** 0.5)
+
+    buf = StringIO()
+    with stage("svg_save"):
+        p.save(buf, format="svg", width=fig_width, height= fig_height, dpi=dpi,
+               limitsize=False, verbose=False, bbox_inches='tight')
+    buf.seek(0)
+
+    return buf.read()
+
+
+def warm_up():
+    """
+    Render a tiny dummy plot once per process.
+
+    Loads the lazily imported parts of plotnine and matplotlib and builds the
+    font cache, so the first real graph request does not pay for them.
+    """
+    global _warm
+    if _warm:
+        return
+    df = pd.DataFrame({
+        "Group": ["a", "a", "b", "b"],
+        "Vars": ["x", "y", "x", "y"],
+        "value": [1.0, 2.0, 3.0, 4.0],
+    })
+    spec = {"xaxis": "Vars", "frows": ".", "fcols": ".", "group": "Group",
+            "palette": "GnBu", "graph_type": "Boxplot", "bar_stat": "mean", "error_bars": "none"}
+    render_graph(df, spec)
+    _warm = True
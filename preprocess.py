@@ -0,0 +1,118 @@
+"""
+Upload preprocessing
+
+The /upload options (ID splitting, FlowJo cleanup, gate prefix removal) are
+compiled once per upload into an UploadPlan. Column names are the same in
+every chunk of a CSV, so the plan rewrites them up front, in one pass per
+name. Applying it to a chunk is then a single row mask, one split of the
+Identifier column and one assembly of the output frame.
+"""
+
+# FlowJo appends summary rows that are not samples
+FLOWJO_FOOTER_ROWS = ["Mean", "SD"]
+
+
+def rewrite_column_name(name, flowjo=False, prefix_number=0):
+    """
+    Final name of an uploaded column.
+
+    Drops "Freq. of " and then the first prefix_number "/" separated gate
+    prefixes, e.g. "Lymphocytes/Single Cells/CD4 | Freq. of Parent" becomes
+    "Single Cells/CD4 | Parent" with prefix_number=1.
+    """
+    if not flowjo:
+        return name
+    name = name.replace('Freq. of ', '')
+    if prefix_number > 0:
+        name = name.split("/", prefix_number)[-1]
+    return name
+
+
+class UploadPlan:
+    """
+    The /upload preprocessing of one CSV, compiled from its header.
+
+    apply() turns a raw chunk into the rows stored in the session table:
+    the first column renamed to Identifier with ".fcs" removed, FlowJo
+    Mean/SD rows dropped, the ID parts split into split_cols as categorical
+    columns right after it, integer columns downcast, and every column
+    renamed once. IDs with fewer parts get None in the missing split
+    columns, call finish() once every chunk is applied to check that the IDs
+    split into split_cols at all.
+    """
+
+    def __init__(self, header, split_cols=None, split_symbol=None, flowjo=False, prefix_number=0):
+        header = list(header)
+        self.split_cols = list(split_cols or [])
+        self.split_symbol = split_symbol
+        self.flowjo = flowjo
+        # Most parts any applied chunk's IDs were split into
+        self.split_parts = 0
+
+        # Split columns replace uploaded columns of the same name
+        replaced = set(self.split_cols) | {"Identifier"}
+        self.data_columns = [c for c in header[1:] if c not in replaced]
+        self.columns = [rewrite_column_name(c, flowjo, prefix_number)
+                        for c in ["Identifier"] + self.split_cols + self.data_columns]
+        # Usually nothing is replaced and the chunk's columns are edited in place
+        self.replaces = len(self.data_columns) != len(header) - 1
+
+    def kept_rows(self, ids):
+        """
+        Rows left after the FlowJo filter: a slice when they are a leading
+        run, as with the trailing Mean/SD rows, else a boolean mask.
+        """
+        if not self.flowjo:
+            return slice(None)
+        keep = ~ids.str.strip().isin(FLOWJO_FOOTER_ROWS).to_numpy()
+        stop = len(keep)
+        while stop and not keep[stop - 1]:
+            stop -= 1
+        if keep[:stop].all():
+            return slice(0, stop)
+        return keep
+
+    def apply(self, chunk):
+        """
+        Preprocess one chunk, chunks are independent of each other.
+
+        The marker values are never copied when the kept rows are a slice:
+        the result is a view of chunk with the new and changed ID columns
+        swapped in, so chunk must not be used afterwards.
+        """
+        import pandas as pd
+
+        rows = self.kept_rows(chunk.iloc[:, 0])
+        if self.replaces:
+            # Uploaded columns named like a split column are dropped, by copying
+            chunk = chunk[[chunk.columns[0]] + self.data_columns]
+        # A new frame on the same blocks: edits below do not touch the caller's frame
+        out = pd.DataFrame(chunk.iloc[rows] if isinstance(rows, slice) else chunk[rows])
+
+        ids = out.iloc[:, 0].str.replace(".fcs", "", regex=False)
+        out.isetitem(0, ids)
+        if self.split_cols:
+            split = ids.str.split(self.split_symbol, n=len(self.split_cols) - 1, expand=True)
+            # Checked by finish(), a chunk of only footer-like IDs has fewer parts
+            self.split_parts = max(self.split_parts, split.shape[1])
+            # Few distinct values per ID part, stored as codes until written
+            for i, col in enumerate(self.split_cols):
+                out.insert(1 + i, col, split[i].astype("category") if i in split.columns else None,
+                           allow_duplicates=True)
+
+        # Counts and other integer markers fit in smaller types
+        first = 1 + len(self.split_cols)
+        for i, dtype in enumerate(out.dtypes.iloc[first:], start=first):
+            if pd.api.types.is_integer_dtype(dtype):
+                out.isetitem(i, pd.to_numeric(out.iloc[:, i], downcast="integer"))
+
+        # Every name rewritten in one assignment
+        out.columns = self.columns
+        return out
+
+    def finish(self):
+        """Raise ValueError if no ID of any applied chunk split into every split column"""
+        if self.split_cols and self.split_parts != len(self.split_cols):
+            raise ValueError(
+                f"ID Column Splitting Error: New column names must match number of splits. "
+                f"Expected {len(self.split_cols)} parts, found {self.split_parts}")
@@ -0,0 +1,150 @@
+"""
+Asynchronous render jobs
+
+POST /graph/submit hands the render to a background thread and returns a job
+id straight away, /graph/status/<job_id> is polled for progress and the final
+SVG. Identical requests that are still in flight share one job.
+
+Jobs are rows of the render_jobs table in the coordination database (see
+db.py), so a poll answered by another web worker process sees the same job as
+the one that runs it. A job keeps its render cache key and spec, not the SVG:
+the status route serves it from the render cache and renders it again when
+that process does not have it. Times are wall clock seconds, shared by all
+processes.
+"""
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import config
+from db import get_coordination
+from metrics import drain_stages
+
+# Progress reported for each stage of a job
+STAGES = {
+    "queued": 0.0,
+    "loading": 0.2,
+    "rendering": 0.5,
+    "done": 1.0,
+    "error": 1.0,
+}
+
+
+class RenderJob:
+
+    def __init__(self, key, owner, spec, id=None, status="queued", error=None):
+        self.id = id or uuid.uuid4().hex
+        # Render cache key of the result
+        self.key = key
+        # Filtered table the job renders, only its session may read the result
+        self.owner = owner
+        self.spec = spec
+        self.status = status
+        self.error = error
+
+    def to_dict(self):
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": STAGES[self.status],
+        }
+        if self.status == "error":
+            job["error"] = self.error
+        return job
+
+
+class RenderJobs:
+    """
+    Registry of render jobs run on a small thread pool.
+
+    The threads only wait on the render pool, so their number bounds how many
+    renders a single process queues at once. An unfinished job older than
+    stale seconds, e.g. left behind by a process that died, is not joined.
+    """
+
+    def __init__(self, max_workers, ttl, stale):
+        self.ttl = ttl
+        self.stale = stale
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render-job")
+
+    def submit(self, key, owner, spec, work):
+        """
+        Start work(progress) in the background and return its job.
+
+        work receives a callback taking a stage name and puts the render in
+        the render cache under key. An unfinished job with the same key is
+        returned instead of starting a second render, whichever process runs it.
+        """
+        conn = get_coordination()
+        self._prune(conn)
+        job = RenderJob(key, owner, spec)
+        while True:
+            # Checked and inserted in one statement, so concurrent submits
+            # in several processes start one job
+            inserted = conn.execute("""
+                INSERT INTO render_jobs (id, key, owner, spec, status, created)
+                SELECT ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM render_jobs WHERE key = ? AND finished_at IS NULL AND created > ?)
+            """, (job.id, key, owner, json.dumps(spec), job.status, time.time(), key, time.time() - self.stale)).rowcount
+            if inserted:
+                break
+            row = conn.execute(
+                "SELECT id, owner, status FROM render_jobs WHERE key = ? AND finished_at IS NULL AND created > ?",
+                (key, time.time() - self.stale)
+            ).fetchone()
+            # Else it finished in between, start a new one
+            if row is not None:
+                return RenderJob(key, row[1], spec, id=row[0], status=row[2])
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def finished(self, key, owner, spec):
+        """Register an already available render, e.g. a cache hit, as a done job"""
+        conn = get_coordination()
+        self._prune(conn)
+        job = RenderJob(key, owner, spec, status="done")
+        now = time.time()
+        conn.execute(
+            "INSERT INTO render_jobs (id, key, owner, spec, status, created, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job.id, key, owner, json.dumps(spec), job.status, now, now)
+        )
+        return job
+
+    def get(self, job_id):
+        row = get_coordination().execute(
+            "SELECT id, key, owner, spec, status, error FROM render_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return RenderJob(row[1], row[2], json.loads(row[3]), id=row[0], status=row[4], error=row[5])
+
+    def _update(self, job, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        get_coordination().execute(f"UPDATE render_jobs SET {columns} WHERE id = ?", (*fields.values(), job.id))
+
+    def _run(self, job, work):
+        def progress(stage):
+            self._update(job, status=stage)
+
+        fields = {}
+        try:
+            work(progress)
+            fields["status"] = "done"
+        except Exception as e:
+            fields["error"] = str(e)
+            fields["status"] = "error"
+        finally:
+            # Nobody reads the stage timings of a job thread, they already
+            # went to the histograms
+            drain_stages()
+            self._update(job, finished_at=time.time(), **fields)
+
+    def _prune(self, conn):
+        # Forget finished jobs nobody collected within the ttl, and jobs
+        # whose process died before finishing them
+        conn.execute("DELETE FROM render_jobs WHERE COALESCE(finished_at, created) < ?", (time.time() - self.ttl,))
+
+
+# A job waits for a worker, then renders, before it counts as lost
+jobs = RenderJobs(max_workers=config.RENDER_WORKERS, ttl=config.RENDER_JOB_TTL_SECONDS,
+                  stale=config.RENDER_QUEUE_TIMEOUT_SECONDS + config.RENDER_TIMEOUT_SECONDS + 60)
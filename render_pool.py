@@ -0,0 +1,210 @@
+"""
+Render worker pool
+
+Plots are rendered in a bounded set of pre-warmed worker processes instead of
+on the Flask request thread. Matplotlib's Agg backend is not thread-safe, and a
+pathological facet grid must not be able to block a web worker forever.
+"""
+import atexit
+import importlib
+import multiprocessing
+import queue
+import threading
+import config
+import metrics
+
+
+class RenderError(Exception):
+    """A render failed, timed out or lost its worker"""
+
+
+class RenderTimeout(RenderError):
+    """A render exceeded RENDER_TIMEOUT_SECONDS and its worker was killed"""
+
+
+def _limit_memory(memory_mb):
+    if not memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def resolve(func):
+    """
+    Accept a function or its dotted name, e.g. "plotting.render_graph".
+
+    Passing the name lets the web process hand out renders without importing
+    the plotting stack itself.
+    """
+    if isinstance(func, str):
+        module, _, name = func.rpartition(".")
+        func = getattr(importlib.import_module(module), name)
+    return func
+
+
+def _worker_main(conn, memory_mb):
+    """Worker process loop: warm up once, then run jobs until told to stop"""
+    # Pre-warm: load plotnine and matplotlib and draw a first plot
+    import plotting
+    import metrics
+    plotting.warm_up()
+    _limit_memory(memory_mb)
+    conn.send(("ready", None, []))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args = job
+        metrics.drain_stages()
+        # Stage timings travel back with the result for the parent's metrics
+        try:
+            result = resolve(func)(*args)
+            conn.send(("ok", result, metrics.drain_stages()))
+        except BaseException as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", metrics.drain_stages()))
+
+
+class _Worker:
+
+    def __init__(self, ctx, memory_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.jobs = 0
+
+    def wait_ready(self, timeout):
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            raise RenderError("Render worker failed to start")
+        self.conn.recv()
+        self.ready = True
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    """
+    Fixed-size pool of render processes.
+
+    Each job runs on one idle worker. A job that exceeds the timeout or kills
+    its worker is reported as a RenderError and the worker is replaced, and
+    workers are recycled after max_jobs renders to bound memory growth.
+    """
+
+    def __init__(self, size, timeout, queue_timeout, memory_mb, max_jobs):
+        self.size = size
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.memory_mb = memory_mb
+        self.max_jobs = max_jobs
+        # spawn: never fork a process that is running server threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.memory_mb)
+
+    def start(self):
+        # Workers are spawned on first use, not at import
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._started = True
+
+    def shutdown(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().stop()
+                except queue.Empty:
+                    break
+            self._started = False
+
+    def run(self, func, *args):
+        """Run func(*args) in a worker process and return its result"""
+        self.start()
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise RenderError("All render workers are busy, please try again")
+
+        replace = False
+        try:
+            worker.wait_ready(self.timeout)
+            worker.conn.send((func, args))
+            if not worker.conn.poll(self.timeout):
+                replace = True
+                raise RenderTimeout(f"Render took longer than {self.timeout} seconds and was stopped")
+            status, payload, timings = worker.conn.recv()
+            metrics.record_stages(timings)
+            # A failed job can leave matplotlib state behind, start fresh
+            replace = status == "error"
+        except RenderError:
+            replace = True
+            raise
+        except (EOFError, OSError):
+            # Worker died mid-job, e.g. by hitting its memory cap
+            replace = True
+            raise RenderError("Render worker stopped unexpectedly, the plot may be too large")
+        finally:
+            worker.jobs += 1
+            if replace or worker.jobs >= self.max_jobs:
+                worker.kill()
+                worker = self._spawn()
+            self._idle.put(worker)
+
+        if status == "error":
+            raise RenderError(payload)
+        return payload
+
+
+pool = RenderPool(
+    size=config.RENDER_WORKERS,
+    timeout=config.RENDER_TIMEOUT_SECONDS,
+    queue_timeout=config.RENDER_QUEUE_TIMEOUT_SECONDS,
+    memory_mb=config.RENDER_WORKER_MEMORY_MB,
+    max_jobs=config.RENDER_WORKER_MAX_JOBS,
+)
+atexit.register(pool.shutdown)
+
+# Agg is not thread-safe, the in-process fallback renders one plot at a time
+_in_process_lock = threading.Lock()
+
+
+def run_render(func, *args):
+    """Run a render function in the pool, or in-process if the pool is disabled"""
+    if config.RENDER_POOL_ENABLED:
+        return pool.run(func, *args)
+    with _in_process_lock:
+        try:
+            return resolve(func)(*args)
+        except Exception as e:
+            raise RenderError(str(e))
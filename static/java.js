@@ -28,6 +28,206 @@ document.addEventListener("DOMContentLoaded", function() {
         });
     }
 
+    // Paginated data preview on the graph page
+    const preview = document.getElementById('data_preview');
+
+    if (preview) {
+        const table = document.createElement('table');
+        table.className = 'dataframe';
+        table.setAttribute('border', '1');
+        const thead = table.createTHead();
+        const tbody = table.createTBody();
+        preview.appendChild(table);
+
+        let nextOffset = 0;
+        let loading = false;
+
+        // Fetch the next page and append its rows
+        function loadPage() {
+            if (loading || nextOffset === null) {
+                return;
+            }
+            loading = true;
+
+            fetch('/preview_data?offset=' + nextOffset)
+            .then(response => response.json())
+            .then(data => {
+                if (data.Error) {
+                    throw new Error(data.Error);
+                }
+                if (thead.rows.length === 0) {
+                    const header = thead.insertRow();
+                    data.columns.forEach(col => {
+                        const th = document.createElement('th');
+                        th.textContent = col;
+                        header.appendChild(th);
+                    });
+                }
+                data.rows.forEach(row => {
+                    const tr = tbody.insertRow();
+                    row.forEach(value => {
+                        tr.insertCell().textContent = value === null ? '' : value;
+                    });
+                });
+                nextOffset = data.next_offset;
+                loading = false;
+
+                // Keep loading until the preview can scroll
+                if (preview.scrollHeight <= preview.clientHeight) {
+                    loadPage();
+                }
+            })
+            .catch((error) => {
+                console.error('Error:', error);
+                loading = false;
+                nextOffset = null;
+            });
+        }
+
+        preview.addEventListener('scroll', function() {
+            if (preview.scrollTop + preview.clientHeight >= preview.scrollHeight - 200) {
+                loadPage();
+            }
+        });
+
+        loadPage();
+    }
+
+    // Asynchronous plotting: submit the graph form as a render job and poll it
+    const graphForm = document.getElementById('graph_form');
+    const plotOutput = document.getElementById('plot_output');
+    const graphError = document.getElementById('graph_error');
+
+    if (graphForm && plotOutput && graphError) {
+        const plotButton = graphForm.querySelector('button[type="submit"]');
+
+        function pollJob(jobId) {
+            fetch('/graph/status/' + jobId)
+            .then(response => response.json())
+            .then(job => {
+                if (job.Error) {
+                    throw new Error(job.Error);
+                }
+                if (job.status === 'done') {
+                    showPlot(job.fig);
+                } else if (job.status === 'error') {
+                    graphError.textContent = 'Error generating graph: ' + job.error;
+                    plotButton.disabled = false;
+                } else {
+                    graphError.textContent = 'Plotting... ' + Math.round(job.progress * 100) + '%';
+                    setTimeout(function() { pollJob(jobId); }, 500);
+                }
+            })
+            .catch((error) => {
+                console.error('Error:', error);
+                graphError.textContent = 'Error: ' + error.message;
+                plotButton.disabled = false;
+            });
+        }
+
+        const renderMode = document.getElementById('render_mode');
+        const paletteSelect = document.getElementById('palette');
+
+        function showPlot(content) {
+            if (preview) {
+                preview.remove();
+            }
+            plotOutput.replaceChildren();
+            if (typeof content === 'string') {
+                plotOutput.innerHTML = content;
+            } else {
+                plotOutput.appendChild(content);
+            }
+            graphError.textContent = '';
+            const downloadForm = document.getElementById('download_form');
+            if (downloadForm) {
+                downloadForm.style.display = 'block';
+            }
+            plotButton.disabled = false;
+        }
+
+        // Browser rendering: fetch the plot geometry and draw it as SVG. The
+        // geometry does not depend on the palette, it is colored separately
+        let lastGeometry = null;
+
+        function drawColored(geometry) {
+            const params = new URLSearchParams({palette: paletteSelect.value, n: geometry.levels.group.length});
+            return fetch('/plot_colors?' + params)
+            .then(response => response.json())
+            .then(colors => {
+                if (colors.Error) {
+                    throw new Error(colors.Error);
+                }
+                showPlot(drawPlot(Object.assign({}, geometry, {palette: colors})));
+            });
+        }
+
+        function fetchGeometry() {
+            plotButton.disabled = true;
+
+            fetch('/plot_data', {
+                method: 'POST',
+                body: new FormData(graphForm)
+            })
+            .then(response => response.json())
+            .then(geometry => {
+                if (geometry.Error) {
+                    throw new Error(geometry.Error);
+                }
+                lastGeometry = geometry;
+                return drawColored(geometry);
+            })
+            .catch((error) => {
+                console.error('Error:', error);
+                graphError.textContent = 'Error: ' + error.message;
+                plotButton.disabled = false;
+            });
+        }
+
+        // A new palette only needs new colors, redraw the last geometry
+        if (renderMode && paletteSelect) {
+            paletteSelect.addEventListener('change', function() {
+                if (renderMode.value === 'browser' && lastGeometry && plotOutput.querySelector('svg.browser-plot')) {
+                    drawColored(lastGeometry).catch((error) => {
+                        console.error('Error:', error);
+                        graphError.textContent = 'Error: ' + error.message;
+                    });
+                }
+            });
+        }
+
+        graphForm.addEventListener('submit', function(event) {
+            // Batch plots are a regular form post returning a page or a zip
+            if (event.submitter && event.submitter.id === 'batch_button') {
+                return;
+            }
+            event.preventDefault();
+
+            if (renderMode && renderMode.value === 'browser') {
+                fetchGeometry();
+                return;
+            }
+            plotButton.disabled = true;
+
+            fetch('/graph/submit', {
+                method: 'POST',
+                body: new FormData(graphForm)
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.Error) {
+                    throw new Error(data.Error);
+                }
+                pollJob(data.job_id);
+            })
+            .catch((error) => {
+                console.error('Error:', error);
+                graphError.textContent = 'Error: ' + error.message;
+                plotButton.disabled = false;
+            });
+        });
+    }
+
     // Get all elements
     const leftValues = document.getElementById('leftValues_Cat');
     const centerValues = document.getElementById('centerValues');
@@ -121,3 +321,208 @@ document.addEventListener("DOMContentLoaded", function() {
 });
 
 
+
+
+// Draw the geometry from /plot_data, with the fill colors from /plot_colors as
+// its palette, as an SVG element: boxes with jittered points or bars with
+// error bars, in a facet grid with free y scales
+function drawPlot(geometry) {
+    const NS = 'http://www.w3.org/2000/svg';
+    const PX = 72;                  // pixels per inch of the server layout
+    const levels = geometry.levels;
+    const cells = geometry.cells;
+    const points = geometry.points;
+    const layout = geometry.layout;
+    const isBox = geometry.graph_type === 'Boxplot';
+    const stat = geometry.bar_stat;
+    const errorBars = geometry.error_bars;
+
+    function el(name, attrs, parent) {
+        const node = document.createElementNS(NS, name);
+        for (const key in attrs) {
+            node.setAttribute(key, attrs[key]);
+        }
+        if (parent) {
+            parent.appendChild(node);
+        }
+        return node;
+    }
+
+    function text(content, attrs, parent) {
+        const node = el('text', Object.assign({'font-size': 11, 'font-family': 'sans-serif'}, attrs), parent);
+        node.textContent = content;
+        return node;
+    }
+
+    function longest(labels) {
+        return Math.max(0, ...labels.map(label => String(label).length));
+    }
+
+    // Round tick steps of 1, 2 or 5 times a power of ten
+    function niceTicks(low, high, count) {
+        if (low === high) {
+            low -= 1;
+            high += 1;
+        }
+        const raw = (high - low) / count;
+        const power = Math.pow(10, Math.floor(Math.log10(raw)));
+        const step = [1, 2, 5, 10].map(m => m * power).find(s => s >= raw);
+        const ticks = [];
+        for (let t = Math.ceil(low / step) * step; t <= high + step * 1e-9; t += step) {
+            ticks.push(Number(t.toPrecision(12)));
+        }
+        return ticks;
+    }
+
+    // Deterministic jitter, the same points land in the same place on every redraw
+    function jitter(i) {
+        const x = Math.sin(i * 12.9898) * 43758.5453;
+        return x - Math.floor(x) - 0.5;
+    }
+
+    const nCells = cells.x.length;
+    const panelW = layout.panel_width * PX;
+    const panelH = layout.panel_height * PX;
+    const hasRows = levels.row[0] !== null;
+    const hasCols = levels.col[0] !== null;
+    const stripSize = 20;
+    const axisW = 55;
+    const labelsH = Math.min(140, 12 + 6.5 * longest(levels.x));
+    const legendW = layout.legend ? 40 + 6.5 * Math.max(longest(levels.group), geometry.columns.group.length) : 0;
+    const cellW = axisW + panelW + (hasRows ? stripSize : 0);
+    const cellH = (hasCols ? stripSize : 0) + panelH + labelsH;
+
+    const width = legendW + cellW * layout.ncol + 10;
+    const height = cellH * layout.nrow + 10;
+    const svg = el('svg', {width: width, height: height, viewBox: `0 0 ${width} ${height}`, class: 'browser-plot'});
+
+    // Groups dodged side by side within each x tick of a panel, in level order
+    const dodge = {};
+    for (let i = 0; i < nCells; i++) {
+        const key = `${cells.row[i]}|${cells.col[i]}|${cells.x[i]}`;
+        (dodge[key] = dodge[key] || []).push(cells.group[i]);
+    }
+    for (const key in dodge) {
+        dodge[key].sort((a, b) => a - b);
+    }
+    const band = panelW / levels.x.length;
+    function slot(row, col, x, group) {
+        const groups = dodge[`${row}|${col}|${x}`] || [group];
+        const width = band * 0.8 / groups.length;
+        const center = band * (x + 0.5) + (groups.indexOf(group) - (groups.length - 1) / 2) * width;
+        return {center: center, width: width};
+    }
+
+    for (let r = 0; r < layout.nrow; r++) {
+        for (let c = 0; c < layout.ncol; c++) {
+            const mine = [];
+            for (let i = 0; i < nCells; i++) {
+                if (cells.row[i] === r && cells.col[i] === c) {
+                    mine.push(i);
+                }
+            }
+            const minePoints = [];
+            if (points) {
+                for (let i = 0; i < points.value.length; i++) {
+                    if (points.row[i] === r && points.col[i] === c && points.value[i] !== null) {
+                        minePoints.push(i);
+                    }
+                }
+            }
+
+            // Free y scale per panel
+            let values = [];
+            if (isBox) {
+                mine.forEach(i => values.push(cells.whisker_low[i], cells.whisker_high[i]));
+                minePoints.forEach(i => values.push(points.value[i]));
+            } else {
+                values.push(0);
+                mine.forEach(i => {
+                    const err = errorBars === 'none' ? 0 : (cells[errorBars][i] || 0);
+                    values.push(cells[stat][i] - err, cells[stat][i] + err);
+                });
+            }
+            values = values.filter(v => v !== null && !Number.isNaN(v));
+            if (values.length === 0) {
+                continue;
+            }
+            const ticks = niceTicks(Math.min(...values), Math.max(...values), 5);
+            const low = Math.min(ticks[0], ...values);
+            const high = Math.max(ticks[ticks.length - 1], ...values);
+            const y = v => panelH - (v - low) / (high - low || 1) * panelH;
+
+            const originX = legendW + c * cellW + axisW;
+            const originY = r * cellH + (hasCols ? stripSize : 0);
+            const panel = el('g', {transform: `translate(${originX},${originY})`}, svg);
+
+            // Facet strips
+            if (hasCols && r === 0) {
+                el('rect', {x: 0, y: -stripSize, width: panelW, height: stripSize, fill: '#d9d9d9'}, panel);
+                text(levels.col[c], {x: panelW / 2, y: -6, 'text-anchor': 'middle'}, panel);
+            }
+            if (hasRows && c === layout.ncol - 1) {
+                el('rect', {x: panelW, y: 0, width: stripSize, height: panelH, fill: '#d9d9d9'}, panel);
+                text(levels.row[r], {x: 0, y: 0, 'text-anchor': 'middle',
+                                     transform: `translate(${panelW + 14},${panelH / 2}) rotate(90)`}, panel);
+            }
+
+            // Axes
+            el('line', {x1: 0, y1: 0, x2: 0, y2: panelH, stroke: 'black'}, panel);
+            el('line', {x1: 0, y1: panelH, x2: panelW, y2: panelH, stroke: 'black'}, panel);
+            ticks.forEach(t => {
+                el('line', {x1: -4, y1: y(t), x2: 0, y2: y(t), stroke: 'black'}, panel);
+                text(t, {x: -7, y: y(t) + 4, 'text-anchor': 'end'}, panel);
+            });
+            levels.x.forEach((label, x) => {
+                const cx = band * (x + 0.5);
+                el('line', {x1: cx, y1: panelH, x2: cx, y2: panelH + 4, stroke: 'black'}, panel);
+                text(label, {x: 0, y: 0, 'text-anchor': 'end',
+                             transform: `translate(${cx + 4},${panelH + 8}) rotate(-90)`}, panel);
+            });
+
+            mine.forEach(i => {
+                const s = slot(r, c, cells.x[i], cells.group[i]);
+                const color = geometry.palette[cells.group[i]];
+                if (isBox) {
+                    const half = s.width * 0.35;
+                    el('line', {x1: s.center, y1: y(cells.whisker_low[i]), x2: s.center, y2: y(cells.q1[i]), stroke: 'black'}, panel);
+                    el('line', {x1: s.center, y1: y(cells.q3[i]), x2: s.center, y2: y(cells.whisker_high[i]), stroke: 'black'}, panel);
+                    el('rect', {x: s.center - half, y: y(cells.q3[i]), width: 2 * half,
+                                height: Math.max(0, y(cells.q1[i]) - y(cells.q3[i])),
+                                fill: color, 'fill-opacity': 0.2, stroke: 'black'}, panel);
+                    el('line', {x1: s.center - half, y1: y(cells.median[i]), x2: s.center + half, y2: y(cells.median[i]),
+                                stroke: 'black', 'stroke-width': 2}, panel);
+                } else {
+                    const value = cells[stat][i];
+                    const half = s.width * 0.45;
+                    el('rect', {x: s.center - half, y: Math.min(y(value), y(0)), width: 2 * half,
+                                height: Math.abs(y(0) - y(value)), fill: color, stroke: 'black'}, panel);
+                    if (errorBars !== 'none' && cells[errorBars][i]) {
+                        const err = cells[errorBars][i];
+                        const cap = s.width * 0.15;
+                        el('line', {x1: s.center, y1: y(value - err), x2: s.center, y2: y(value + err), stroke: 'black'}, panel);
+                        el('line', {x1: s.center - cap, y1: y(value - err), x2: s.center + cap, y2: y(value - err), stroke: 'black'}, panel);
+                        el('line', {x1: s.center - cap, y1: y(value + err), x2: s.center + cap, y2: y(value + err), stroke: 'black'}, panel);
+                    }
+                }
+            });
+
+            minePoints.forEach(i => {
+                const s = slot(r, c, points.x[i], points.group[i]);
+                el('circle', {cx: s.center + jitter(i) * s.width * 0.3, cy: y(points.value[i]), r: 2.5,
+                              fill: geometry.palette[points.group[i]], stroke: 'black', 'stroke-width': 0.5}, panel);
+            });
+        }
+    }
+
+    // Legend on the left, like the server rendered plots
+    if (layout.legend) {
+        const legend = el('g', {transform: `translate(10,${(hasCols ? stripSize : 0) + 10})`}, svg);
+        text(geometry.columns.group, {x: 0, y: 0, 'font-size': 10}, legend);
+        levels.group.forEach((label, i) => {
+            el('rect', {x: 0, y: 8 + i * 16, width: 12, height: 12, fill: geometry.palette[i], stroke: 'black'}, legend);
+            text(label, {x: 18, y: 18 + i * 16, 'font-size': 10}, legend);
+        });
+    }
+    return svg;
+}
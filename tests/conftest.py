@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture(scope="session")
+def flask_app(tmp_path_factory):
+    """The web app on a throwaway database, rendering in the request thread"""
+    config.DATABASE_PATH = str(tmp_path_factory.mktemp("db") / "test.db")
+    config.SECRET_KEY = "test"
+    config.RENDER_POOL_ENABLED = False
+    import app
+    from expiry import stop_expiry_scheduler
+    # Tests sweep explicitly
+    stop_expiry_scheduler()
+    app.app.config["TESTING"] = True
+    return app.app
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+def upload(client, text, **form):
+    """POST a csv to /upload, returns the response"""
+    import io
+    data = {"DataFile": (io.BytesIO(text.encode("utf-8")), "export.csv"), **form}
+    return client.post("/upload", data=data, content_type="multipart/form-data")
+
+
+SAMPLE_CSV = "Sample,Group,CD4,CD8\n" + "".join(f"s{i},g{i % 2},{i},{i * 2}\n" for i in range(20))
+
+
+def upload_and_melt(client, csv=SAMPLE_CSV, categorical=("Identifier", "Group"), continuous=("CD4", "CD8")):
+    """Upload csv and melt it, returns the /process_columns JSON"""
+    assert upload(client, csv).status_code == 200
+    response = client.post("/process_columns", json={"categorical": list(categorical), "continuous": list(continuous)})
+    assert response.status_code == 200
+    return response.get_json()
@@ -0,0 +1,72 @@
+import sqlite3
+import time
+
+import pytest
+
+import config
+from admission import admit, in_flight, AdmissionError
+from conftest import upload_and_melt
+from db import get_coordination
+
+
+def other_process_render(owner, cost):
+    """A render admitted by another web worker process"""
+    get_coordination().execute(
+        "INSERT INTO render_admissions (id, owner, cost, state, started) VALUES (?, ?, ?, 'running', ?)",
+        (f"other-{owner}-{cost}", owner, cost, time.time()))
+
+
+@pytest.fixture
+def clean_admissions(flask_app):
+    yield
+    get_coordination().execute("DELETE FROM render_admissions")
+
+
+def test_session_limit_counts_renders_of_every_process(clean_admissions, monkeypatch):
+    monkeypatch.setattr("config.RENDER_MAX_PER_SESSION", 1)
+    other_process_render("filtered_a", 10)
+    with pytest.raises(AdmissionError) as error:
+        with admit("filtered_a", 10):
+            pass
+    assert error.value.status == 429
+    # Other sessions are not held up
+    with admit("filtered_b", 10):
+        assert in_flight() == (20, 2)
+    assert in_flight() == (10, 1)
+
+
+def test_budget_counts_renders_of_every_process(clean_admissions, monkeypatch):
+    monkeypatch.setattr("config.RENDER_BUDGET", 100)
+    monkeypatch.setattr("config.RENDER_QUEUE_TIMEOUT_SECONDS", 0.3)
+    other_process_render("filtered_a", 80)
+    with pytest.raises(AdmissionError) as error:
+        with admit("filtered_b", 30):
+            pass
+    assert error.value.status == 503
+    with admit("filtered_b", 20):
+        pass
+
+
+def test_admission_does_not_wait_for_the_session_write_lock(clean_admissions):
+    # An upload or melt in another process holds the session store's write lock
+    writer = sqlite3.connect(config.DATABASE_PATH, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        with admit("filtered_a", 10):
+            pass
+        assert time.monotonic() - started < 1
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_too_large_render_reads_no_rows(client, monkeypatch):
+    import app as webapp
+    upload_and_melt(client)
+    monkeypatch.setattr("config.RENDER_MAX_PANELS", 1)
+    reads = []
+    monkeypatch.setattr(webapp, "read_session_table", lambda *args, **kwargs: reads.append(args))
+    response = client.post("/graph", data={"Graph_type": "Boxplot", "Xfacet_Select": "Identifier"})
+    assert response.status_code == 400
+    assert reads == []
@@ -0,0 +1,29 @@
+import io
+import zipfile
+
+from conftest import upload_and_melt
+
+
+def test_zip_entries_are_unique(client):
+    csv = "Sample,Group,CD4+CD8+,CD4 CD8\n" + "".join(f"s{i},g{i % 2},{i},{i * 2}\n" for i in range(10))
+    upload_and_melt(client, csv, continuous=("CD4+CD8+", "CD4 CD8"))
+    response = client.post("/graph/batch", data={"Graph_type": "Boxplot", "split_by": "Vars", "batch_output": "svg"})
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert sorted(names) == ["CD4_CD8.svg", "CD4_CD8_2.svg"]
+
+
+def test_downsampling_note_is_per_plot(client, monkeypatch):
+    import app as webapp
+
+    # 30 points in g0, 10 in g1
+    csv = "Sample,Group,CD4,CD8\n" + "".join(f"s{i},{'g1' if i < 5 else 'g0'},{i},{i * 2}\n" for i in range(20))
+    upload_and_melt(client, csv)
+    monkeypatch.setattr("config.RENDER_MAX_POINTS", 10)
+    monkeypatch.setattr("config.BOXPLOT_LARGE_N_THRESHOLD", 1000)
+    calls = []
+    monkeypatch.setattr(webapp, "run_render", lambda func, *args: calls.append(args) or [])
+    response = client.post("/graph/batch", data={"Graph_type": "Boxplot", "split_by": "Group"})
+    assert response.status_code == 200
+    notes = {value: note for args in calls for value, note in args[-1].items()}
+    assert notes == {"g1": None, "g0": "Showing at most 5 points per box, 30 in total"}
@@ -0,0 +1,24 @@
+from conftest import SAMPLE_CSV
+from cli import main, find_inputs, unique_names
+
+
+def test_recursive_inputs_mirror_their_relative_paths(tmp_path):
+    inputs = tmp_path / "in"
+    (inputs / "sub").mkdir(parents=True)
+    (inputs / "a.csv").write_text(SAMPLE_CSV)
+    (inputs / "sub" / "a.csv").write_text(SAMPLE_CSV)
+    out = tmp_path / "out"
+
+    assert main([str(inputs), "--recursive", "-o", str(out), "-j", "1", "--categorical", "Identifier", "Group"]) == 0
+    assert (out / "a.svg").exists()
+    assert (out / "sub" / "a.svg").exists()
+
+
+def test_taken_output_names_are_suffixed(tmp_path):
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "a.csv").write_text(SAMPLE_CSV)
+
+    inputs, renamed = unique_names(find_inputs([str(tmp_path / "one"), str(tmp_path / "two")]))
+    assert [name for _, name in inputs] == ["a", "a_2"]
+    assert renamed == [(str(tmp_path / "two" / "a.csv"), "a_2")]
@@ -0,0 +1,9 @@
+from conftest import upload_and_melt
+
+
+def test_unknown_download_format_is_rejected(client):
+    upload_and_melt(client)
+    client.post("/graph", data={"Graph_type": "Boxplot"})
+    response = client.get("/download_plot", query_string={"format": "bmp"})
+    assert response.status_code == 400
+    assert response.get_data(as_text=True) == "Unknown download format: bmp"
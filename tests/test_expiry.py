@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from conftest import upload
+from db import transaction
+from expiry import sweep_expired_tables
+
+
+def session_tables(client):
+    with client.session_transaction() as sess:
+        return [sess[key] for key in ("table_name", "filtered_table") if sess.get(key)]
+
+
+def age_tables(tables, minutes):
+    """Move these tables' Created times back, as if that much time had passed"""
+    with transaction() as conn:
+        for table in tables:
+            created, = conn.execute("SELECT Created FROM table_lifetime WHERE id = ?", (table,)).fetchone()
+            older = datetime.fromisoformat(created) - timedelta(minutes=minutes)
+            conn.execute("UPDATE table_lifetime SET Created = ? WHERE id = ?", (older.isoformat(), table))
+
+
+def test_sweep_keeps_source_of_live_melt_view(client, monkeypatch):
+    monkeypatch.setattr("config.MELT_MODE", "view")
+    # Content no other test uploads, so no other session shares its table
+    csv = "Sample,Group,CD4,CD8\n" + "".join(f"e{i},g{i % 2},{i},{i * 5}\n" for i in range(20))
+    assert upload(client, csv).status_code == 200
+
+    # Uploaded at T-121 minutes, melted at T-110 minutes, swept at T
+    age_tables(session_tables(client), 11)
+    response = client.post("/process_columns", json={"categorical": ["Identifier", "Group"],
+                                                     "continuous": ["CD4", "CD8"]})
+    assert response.status_code == 200
+    age_tables(session_tables(client), 110)
+    sweep_expired_tables()
+
+    response = client.get("/preview_data")
+    assert response.status_code == 200
+    assert response.get_json()["columns"] == ["Identifier", "Group", "Vars", "value"]
+    response = client.post("/graph", data={"Graph_type": "Boxplot"})
+    assert "no such table" not in response.get_data(as_text=True)
+    assert "<svg" in response.get_data(as_text=True)
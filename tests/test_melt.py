@@ -0,0 +1,36 @@
+import pandas as pd
+
+import helpers
+from cell_stats import summarize_melt
+from conftest import upload_and_melt
+from db import get_connection
+
+CSV = "Sample,Group,CD3,CD4,CD8\n" + "".join(f"s{i},g{i % 3},{i % 7},{i * 2},{(i * 5) % 11}\n" for i in range(30))
+
+
+def test_view_remelt_summarizes_only_added_markers(client, monkeypatch):
+    monkeypatch.setattr("config.MELT_MODE", "view")
+    old = upload_and_melt(client, CSV, continuous=("CD4", "CD8"))["table"]
+
+    summarized = []
+    summarize_markers = helpers.summarize_markers
+    monkeypatch.setattr(helpers, "summarize_markers",
+                        lambda conn, source, categorical, markers: summarized.append(markers)
+                        or summarize_markers(conn, source, categorical, markers))
+    # A new marker in the middle, one removed
+    response = client.post("/process_columns", json={"categorical": ["Identifier", "Group"],
+                                                     "continuous": ["CD3", "CD4"]})
+    assert response.status_code == 200
+    new = response.get_json()["table"]
+    assert summarized == [["CD3"]]
+
+    conn = get_connection()
+    assert helpers.melt_format(conn, old) is None
+    assert conn.execute("SELECT COUNT(*) FROM table_lifetime WHERE id = ?", (new,)).fetchone()[0] == 1
+
+    with client.session_transaction() as sess:
+        source = sess["table_name"]
+    wide = pd.read_sql(f"SELECT Identifier, \"Group\", CD3, CD4 FROM {source}", conn)
+    expected = summarize_melt(wide.melt(id_vars=["Identifier", "Group"], var_name="Vars"))
+    pd.testing.assert_frame_equal(helpers.read_summary(conn, new), expected, check_dtype=False)
+    assert pd.read_sql(f"SELECT * FROM {new}", conn)["Vars"].unique().tolist() == ["CD3", "CD4"]
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import upload_and_melt
+
+
+def test_palette_change_reuses_the_geometry(client, monkeypatch):
+    import app as webapp
+
+    upload_and_melt(client)
+    renders = []
+    run_render = webapp.run_render
+    monkeypatch.setattr(webapp, "run_render", lambda func, *args: renders.append(func) or run_render(func, *args))
+    form = {"Graph_type": "Boxplot", "group": "Group"}
+    first = client.post("/plot_data", data={**form, "palette": "GnBu"})
+    second = client.post("/plot_data", data={**form, "palette": "Pastel1"})
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert "palette" not in first.get_json()
+    assert renders == ["plotting.plot_geometry"]
+
+
+def test_plot_colors(client):
+    colors = client.get("/plot_colors", query_string={"palette": "Pastel1", "n": 3}).get_json()
+    assert len(colors) == 3 and all(c.startswith("#") for c in colors)
+    assert client.get("/plot_colors", query_string={"palette": "nope", "n": 3}).status_code == 400
+    assert client.get("/plot_colors", query_string={"palette": "GnBu", "n": 0}).status_code == 400
+
+
+def test_plot_data_is_admitted_before_reading_rows(client, monkeypatch):
+    import app as webapp
+
+    upload_and_melt(client)
+    monkeypatch.setattr("config.RENDER_MAX_PANELS", 1)
+    monkeypatch.setattr(webapp, "read_session_table", lambda *args, **kwargs: pytest.fail("rows were read"))
+    response = client.post("/plot_data", data={"Graph_type": "Boxplot", "palette": "GnBu", "Xfacet_Select": "Group"})
+    assert response.status_code == 400
+    assert "facet panels" in response.get_json()["Error"]
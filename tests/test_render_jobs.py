@@ -0,0 +1,44 @@
+import time
+
+from conftest import upload_and_melt
+from helpers import render_cache
+from render_jobs import RenderJobs
+
+
+def test_job_status_is_shared_between_registries(client):
+    upload_and_melt(client)
+    response = client.post("/graph/submit", data={"Graph_type": "Boxplot"})
+    job_id = response.get_json()["job_id"]
+
+    # Another web worker process has its own registry over the same database
+    other = RenderJobs(max_workers=1, ttl=600, stale=60)
+    deadline = time.monotonic() + 30
+    while other.get(job_id).status not in ("done", "error") and time.monotonic() < deadline:
+        time.sleep(0.1)
+    job = other.get(job_id)
+    assert job.status == "done"
+
+    status = client.get(f"/graph/status/{job_id}").get_json()
+    assert status["status"] == "done" and status["progress"] == 1.0
+    assert "<svg" in status["fig"]
+
+
+def test_evicted_render_is_rendered_again(client):
+    upload_and_melt(client)
+    response = client.post("/graph/submit", data={"Graph_type": "Boxplot"})
+    job_id = response.get_json()["job_id"]
+    deadline = time.monotonic() + 30
+    while client.get(f"/graph/status/{job_id}").get_json()["status"] not in ("done", "error") \
+            and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    # The job row keeps the cache key, not the SVG
+    render_cache.clear()
+    status = client.get(f"/graph/status/{job_id}").get_json()
+    assert status["status"] == "done"
+    assert "<svg" in status["fig"]
+
+
+def test_unknown_job_is_not_found(client):
+    upload_and_melt(client)
+    assert client.get("/graph/status/nope").status_code == 404
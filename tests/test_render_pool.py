@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from render_pool import RenderPool, RenderTimeout
+
+SPEC = {"xaxis": "Vars", "frows": ".", "fcols": ".", "group": "Group",
+        "palette": "GnBu", "graph_type": "Boxplot", "bar_stat": "mean", "error_bars": "none"}
+
+
+@pytest.fixture
+def pool():
+    # One real spawned worker, replaced after every job
+    pool = RenderPool(size=1, timeout=60, queue_timeout=60, memory_mb=0, max_jobs=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_render_in_a_worker_that_is_recycled(pool):
+    df = pd.DataFrame({"Group": ["a", "a", "b", "b"], "Vars": ["x", "y", "x", "y"], "value": [1.0, 2.0, 3.0, 4.0]})
+    assert "<svg" in pool.run("plotting.render_graph", df, SPEC)
+    assert pool.run("os.getpid") != pool.run("os.getpid")
+
+
+def test_timed_out_render_replaces_its_worker(pool):
+    # A warm worker, so the short timeout only applies to the job
+    pool.max_jobs = 10
+    pid = pool.run("os.getpid")
+    pool.timeout = 0.5
+    with pytest.raises(RenderTimeout):
+        pool.run("time.sleep", 5)
+    pool.timeout = 60
+    assert pool.run("os.getpid") != pid
@@ -0,0 +1,63 @@
+from conftest import upload, upload_and_melt
+from db import get_connection
+
+# Content no other test uploads, so no other session shares its table
+SHARED_CSV = "Sample,Group,CD4,CD8\n" + "".join(f"r{i},g{i % 3},{i},{i * 3}\n" for i in range(15))
+
+
+def uploaded_table(client):
+    with client.session_transaction() as sess:
+        return sess["table_name"]
+
+
+def refs(table):
+    """The table's reference count, None once it was dropped"""
+    conn = get_connection()
+    row = conn.execute("SELECT refs FROM table_lifetime WHERE id = ?", (table,)).fetchone()
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    assert (row is None) == (exists is None)
+    return None if row is None else row[0]
+
+
+def test_split_ids_with_footer_alone_in_last_chunk(client, monkeypatch):
+    # The Mean/SD rows of a FlowJo export are the whole last chunk
+    monkeypatch.setattr("config.UPLOAD_CHUNK_ROWS", 4)
+    csv = ("Sample,CD4\n"
+           + "".join(f"D{i}_Stim.fcs,{i}\n" for i in range(4))
+           + "Mean,1.5\nSD,1.1\n")
+    response = upload(client, csv, split_ids="on", splitID_columns="Donor, Condition", splitID_separator="_")
+    page = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "Splitting Error" not in page
+    assert "Donor" in page and "Condition" in page
+
+
+def test_split_ids_never_matching_is_rejected(client, monkeypatch):
+    monkeypatch.setattr("config.UPLOAD_CHUNK_ROWS", 2)
+    csv = "Sample,CD4\n" + "".join(f"D{i}.fcs,{i}\n" for i in range(5))
+    response = upload(client, csv, split_ids="on", splitID_columns="Donor, Condition", splitID_separator="_")
+    assert "Expected 2 parts, found 1" in response.get_data(as_text=True)
+
+
+def test_identical_uploads_share_one_table(flask_app):
+    first, second = flask_app.test_client(), flask_app.test_client()
+    upload_and_melt(first, SHARED_CSV)
+    upload_and_melt(second, SHARED_CSV)
+    table = uploaded_table(first)
+    assert uploaded_table(second) == table
+    assert refs(table) == 2
+
+    # Uploading it again in the same session keeps its one reference
+    upload_and_melt(second, SHARED_CSV)
+    assert refs(table) == 2
+
+    # One session deletes while the other still plots from it
+    first.get("/delete")
+    assert refs(table) == 1
+    response = second.post("/graph", data={"Graph_type": "Boxplot"})
+    assert "<svg" in response.get_data(as_text=True)
+
+    # The last reference goes with a new upload
+    assert upload(second, SHARED_CSV.replace("r0,", "other,")).status_code == 200
+    assert uploaded_table(second) != table
+    assert refs(table) is None